@@ -0,0 +1,158 @@
+# activity.py
+
+import time
+import logging
+import importlib.util
+from array import array
+
+logger = logging.getLogger('chode.activity')
+
+# NumPy is optional here; when installed, bucket expiry and window sums run as array operations
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+
+# ---------------------- Guild Activity ----------------------
+
+class GuildActivity:
+    """
+    Sliding-window message counts for the members of one guild.
+    Each member has a fixed ring of 16-bit counters, one per time bucket, stored
+    row by row in a single array. Moving to a new bucket clears that bucket's
+    column for every member at once, so old activity falls out of the window
+    without per-member bookkeeping.
+    """
+
+    def __init__(self, buckets, bucket_seconds):
+        self.buckets = buckets
+        self.bucket_seconds = bucket_seconds
+        self.rows = {}      # user_id -> row
+        self.user_ids = []  # row -> user_id
+        self.counts = array('H')
+        self.current = int(time.time() // bucket_seconds)
+        self.started = time.time()  # When counting began; earlier messages are unknown
+
+    def covers_window(self, now=None):
+        """Whether counting has run for a whole window, so low totals really mean inactivity."""
+        return (time.time() if now is None else now) - self.started >= self.buckets * self.bucket_seconds
+
+    def _matrix(self):
+        import numpy as np
+        return np.frombuffer(self.counts, dtype=np.uint16).reshape(len(self.user_ids), self.buckets)
+
+    def advance(self, now=None):
+        """Clear buckets that have left the window since the last call."""
+        bucket = int((time.time() if now is None else now) // self.bucket_seconds)
+        expired = min(bucket - self.current, self.buckets)
+        if expired <= 0:
+            return
+        columns = [(self.current + step) % self.buckets for step in range(1, expired + 1)]
+        if self.user_ids:
+            if HAS_NUMPY:
+                self._matrix()[:, columns] = 0
+            else:
+                for row in range(len(self.user_ids)):
+                    base = row * self.buckets
+                    for column in columns:
+                        self.counts[base + column] = 0
+        self.current = bucket
+
+    def record(self, user_id, now=None):
+        """Count one message from a user in the current bucket."""
+        self.advance(now)
+        row = self.rows.get(user_id)
+        if row is None:
+            row = self.rows[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.counts.frombytes(bytes(2 * self.buckets))
+        index = row * self.buckets + self.current % self.buckets
+        if self.counts[index] < 0xFFFF:
+            self.counts[index] += 1
+
+    def totals(self, now=None):
+        """Message counts over the whole window, as {user_id: count}."""
+        self.advance(now)
+        if not self.user_ids:
+            return {}
+        if HAS_NUMPY:
+            sums = self._matrix().sum(axis=1).tolist()
+        else:
+            sums = [sum(self.counts[row * self.buckets:(row + 1) * self.buckets]) for row in range(len(self.user_ids))]
+        return dict(zip(self.user_ids, sums))
+
+    def compact(self, totals):
+        """Drop members with no messages left in the window."""
+        keep = [user_id for user_id in self.user_ids if totals.get(user_id)]
+        if len(keep) == len(self.user_ids):
+            return
+        counts = array('H')
+        for user_id in keep:
+            row = self.rows[user_id]
+            counts.extend(self.counts[row * self.buckets:(row + 1) * self.buckets])
+        self.counts = counts
+        self.user_ids = keep
+        self.rows = {user_id: row for row, user_id in enumerate(keep)}
+
+
+class ActivityTracker:
+    """Per-guild sliding-window activity, fed from on_message."""
+
+    def __init__(self, window_hours=72, bucket_minutes=60):
+        self.bucket_seconds = bucket_minutes * 60
+        self.buckets = max(1, int(window_hours * 60 // bucket_minutes))
+        self.guilds = {}  # guild_id -> GuildActivity
+
+    def record(self, guild_id, user_id):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = GuildActivity(self.buckets, self.bucket_seconds)
+        guild.record(user_id)
+
+    def totals(self, guild_id):
+        guild = self.guilds.get(guild_id)
+        return guild.totals() if guild else {}
+
+    def compact(self, guild_id, totals):
+        guild = self.guilds.get(guild_id)
+        if guild:
+            guild.compact(totals)
+
+    def covers_window(self, guild_id):
+        guild = self.guilds.get(guild_id)
+        return guild is not None and guild.covers_window()
+
+    def export_guild(self, guild_id):
+        """Copy one guild's counters, or None if it has none."""
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            return None
+        return {
+            'buckets': self.buckets,
+            'bucket_seconds': self.bucket_seconds,
+            'user_ids': list(guild.user_ids),
+            'counts': guild.counts.tobytes(),
+            'current': guild.current,
+            'started': guild.started
+        }
+
+    def import_guild(self, guild_id, state):
+        """Restore counters exported by export_guild() if the window layout still matches."""
+        if not state or state.get('buckets') != self.buckets or state.get('bucket_seconds') != self.bucket_seconds:
+            return False
+        guild = GuildActivity(self.buckets, self.bucket_seconds)
+        guild.user_ids = list(state['user_ids'])
+        guild.rows = {user_id: row for row, user_id in enumerate(guild.user_ids)}
+        guild.counts = array('H')
+        guild.counts.frombytes(state['counts'])
+        guild.current = state['current']
+        guild.started = state['started']
+        self.guilds[guild_id] = guild
+        return True
+
+    def export_state(self):
+        """Copy the counters of every guild for a snapshot."""
+        return {'guilds': {guild_id: self.export_guild(guild_id) for guild_id in self.guilds}}
+
+    def import_state(self, state):
+        """Restore counters exported by export_state()."""
+        for guild_id, guild_state in (state or {}).get('guilds', {}).items():
+            if isinstance(guild_state, dict):  # Older snapshots have no start time and are skipped
+                self.import_guild(guild_id, guild_state)
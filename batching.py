@@ -0,0 +1,47 @@
+# batching.py
+
+import asyncio
+import logging
+
+logger = logging.getLogger('chode.batching')
+
+# ---------------------- Event Batcher ----------------------
+
+class EventBatcher:
+    """
+    Collect events per channel over a short window and handle them together.
+    The first event for a channel starts the window; when it closes (or max_items
+    is reached) the handler is awaited once with the channel and all collected items.
+    """
+
+    def __init__(self, handler, window=5.0, max_items=50):
+        self.handler = handler
+        self.window = window
+        self.max_items = max_items
+        self.buffers = {}  # channel_id -> (channel, [item, ...])
+        self.timers = {}   # channel_id -> asyncio.TimerHandle
+
+    def add(self, channel, item):
+        """Add an event for a channel. Must be called from the event loop."""
+        buffer = self.buffers.get(channel.id)
+        if buffer is None:
+            buffer = self.buffers[channel.id] = (channel, [])
+            loop = asyncio.get_running_loop()
+            self.timers[channel.id] = loop.call_later(self.window, self._schedule_flush, channel.id)
+        buffer[1].append(item)
+        if len(buffer[1]) >= self.max_items:
+            self._schedule_flush(channel.id)
+
+    def _schedule_flush(self, channel_id):
+        timer = self.timers.pop(channel_id, None)
+        if timer is not None:
+            timer.cancel()
+        buffer = self.buffers.pop(channel_id, None)
+        if buffer is not None:
+            asyncio.get_running_loop().create_task(self._flush(*buffer))
+
+    async def _flush(self, channel, items):
+        try:
+            await self.handler(channel, items)
+        except Exception as e:
+            logger.error("Failed to handle %s batched events for channel %s: %s", len(items), channel.id, e)
@@ -1,24 +1,29 @@
 # commands.py
 
+import os
+import json
 import discord
 from discord.ext import commands
 import logging
 import asyncio
 from datetime import datetime
 from helpers import (
-    generate_response_async, send_long_message, get_member_statuses,
-    is_within_operating_hours, save_configurations, configurations,
-    generate_image
+    generate_response_async, send_long_message, get_member_statuses, get_online_member_count,
+    is_within_operating_hours, config_store, configurations,
+    generate_image, state_ready, hydrate_guild
 )
 from config import WHATSNEW_FILE, get_absolute_path, COMFYUI_SERVER_ADDRESS, COMFYUI_SERVER_PORT
-import aiohttp
-import websockets
-import uuid
-from PIL import Image
-import io
+
+logger = logging.getLogger('chode.commands')
 
 def setup(bot):
 
+    @bot.before_invoke
+    async def wait_for_state(ctx):
+        """Hold commands until startup state is loaded and the guild is hydrated."""
+        await state_ready.wait()
+        await hydrate_guild(ctx.guild)
+
     @bot.command(name='operatinghours')
     async def operating_hours(ctx):
         """Responds with the server's operating hours."""
@@ -26,7 +31,7 @@ def setup(bot):
         config = configurations.get(guild_id)
         if not config:
             await send_long_message(ctx.channel, "Operating hours are not configured for this server.")
-            logging.warning(f"Operating hours requested but not configured in guild {ctx.guild.name}")
+            logger.warning("Operating hours requested but not configured in guild %s", ctx.guild.name)
             return
 
         operating_hours = config.get('operating_hours', "Not set")
@@ -36,10 +41,11 @@ def setup(bot):
             response_from_chode = await generate_response_async(prompt, ctx.guild, ctx.channel.id)
             if response_from_chode and len(response_from_chode) > 0:
                 await send_long_message(ctx.channel, response_from_chode)
-                logging.info(f"Responded to operating hours request from {ctx.author.display_name}: {response_from_chode[:50]}...")
+                logger.info("Responded to operating hours request from %s", ctx.author.display_name)
+                logger.debug("Operating hours response preview: %.50s...", response_from_chode)
             else:
                 await send_long_message(ctx.channel, "Sorry, I couldn't retrieve my operating hours at the moment.")
-                logging.warning(f"No response generated for operating hours request from {ctx.author.display_name}")
+                logger.warning("No response generated for operating hours request from %s", ctx.author.display_name)
 
     @bot.command(name='timecheck')
     async def time_check(ctx):
@@ -50,20 +56,25 @@ def setup(bot):
             response = (f"**Current UTC Time:** {utc_now.strftime('%Y-%m-%d %H:%M:%S')}\n"
                         f"**Current Local Time:** {local_now.strftime('%Y-%m-%d %H:%M:%S')}")
             await send_long_message(channel=ctx.channel, content=response)
-            logging.info(f"Sent timecheck to {ctx.author.display_name}")
+            logger.info("Sent timecheck to %s", ctx.author.display_name)
         except Exception as e:
-            logging.error(f"Failed to execute timecheck command: {str(e)}")
+            logger.error("Failed to execute timecheck command: %s", e)
             await send_long_message(ctx.channel, "Sorry, I couldn't retrieve the current time due to an error.")
 
     @bot.command(name='members')
-    async def members(ctx):
-        """Responds with a list of currently online members."""
+    async def members(ctx, page: int = 1):
+        """
+        Responds with a page of currently online members.
+        Usage: !!members [page]
+        """
         try:
-            statuses = get_member_statuses(ctx.guild)
-            await send_long_message(ctx.channel, f"**Online Members:**\n{statuses}")
-            logging.info(f"Sent members list to {ctx.author.display_name}")
+            statuses, page, total_pages = get_member_statuses(ctx.guild, page)
+            embed = discord.Embed(title=f"Online Members: {get_online_member_count(ctx.guild)}", description=statuses)
+            embed.set_footer(text=f"Page {page}/{total_pages} - use !!members <page> for more")
+            await ctx.send(embed=embed)
+            logger.info("Sent members list page %s to %s", page, ctx.author.display_name)
         except Exception as e:
-            logging.error(f"Failed to execute members command: {str(e)}")
+            logger.error("Failed to execute members command: %s", e)
             await send_long_message(ctx.channel, "Sorry, I couldn't retrieve the member list due to an error.")
 
     @bot.command(name='whatsnew')
@@ -73,7 +84,7 @@ def setup(bot):
             whatsnew_path = get_absolute_path(WHATSNEW_FILE)
             if not os.path.exists(whatsnew_path):
                 await send_long_message(ctx.channel, "There are no new updates at the moment.")
-                logging.info(f"WhatsNew file not found when requested by {ctx.author.display_name}")
+                logger.info("WhatsNew file not found when requested by %s", ctx.author.display_name)
                 return
 
             with open(whatsnew_path, 'r', encoding='utf-8') as file:
@@ -81,7 +92,7 @@ def setup(bot):
 
             if not whats_new_list:
                 await send_long_message(ctx.channel, "There are no new updates at the moment.")
-                logging.info(f"WhatsNew file is empty when requested by {ctx.author.display_name}")
+                logger.info("WhatsNew file is empty when requested by %s", ctx.author.display_name)
                 return
 
             prompt = f"{ctx.author.display_name} wants to know what's new. You have the following updates to share:\n{whats_new_list}"
@@ -90,12 +101,13 @@ def setup(bot):
                 response_from_chode = await generate_response_async(prompt, ctx.guild, ctx.channel.id)
                 if response_from_chode and len(response_from_chode) > 0:
                     await send_long_message(ctx.channel, response_from_chode)
-                    logging.info(f"Responded to whatsnew request from {ctx.author.display_name}: {response_from_chode[:50]}...")
+                    logger.info("Responded to whatsnew request from %s", ctx.author.display_name)
+                    logger.debug("Whatsnew response preview: %.50s...", response_from_chode)
                 else:
                     await send_long_message(ctx.channel, "Sorry, I couldn't retrieve the latest updates at the moment.")
-                    logging.warning(f"No response generated for whatsnew request from {ctx.author.display_name}")
+                    logger.warning("No response generated for whatsnew request from %s", ctx.author.display_name)
         except Exception as e:
-            logging.error(f"Failed to execute whatsnew command: {str(e)}")
+            logger.error("Failed to execute whatsnew command: %s", e)
             await send_long_message(ctx.channel, "An error occurred while retrieving the latest updates.")
 
     @bot.command(name='setupchode')
@@ -105,7 +117,7 @@ def setup(bot):
         guild = ctx.guild
         if not guild:
             await send_long_message(ctx.channel, "Configuration can only be done within a server.")
-            logging.warning("Configuration attempted in DM.")
+            logger.warning("Configuration attempted in DM.")
             return
 
         guild_id = str(guild.id)
@@ -133,10 +145,10 @@ def setup(bot):
             try:
                 user_time = datetime.strptime(user_time_str, "%H:%M")
                 user_timezone = "Local Time"
-                logging.debug(f"User time entered: {user_time_str}, assumed timezone: {user_timezone}")
+                logger.debug("User time entered: %s, assumed timezone: %s", user_time_str, user_timezone)
             except ValueError:
                 await ctx.send("Invalid time format. Please use `HH:MM` in 24-hour format. Configuration aborted.")
-                logging.warning(f"Configuration aborted due to invalid time format by {ctx.author.display_name}")
+                logger.warning("Configuration aborted due to invalid time format by %s", ctx.author.display_name)
                 return
 
             # Step 3: Special instructions
@@ -162,40 +174,40 @@ def setup(bot):
                 start_str, end_str = operating_hours.split('-')
                 start_time = datetime.strptime(start_str.strip(), "%H:%M").time()
                 end_time = datetime.strptime(end_str.strip(), "%H:%M").time()
-                logging.debug(f"Parsed operating hours: Start - {start_time}, End - {end_time}")
+                logger.debug("Parsed operating hours: Start - %s, End - %s", start_time, end_time)
             except ValueError:
                 await ctx.send("Invalid time format for operating hours. Please use `HH:MM-HH:MM` in 24-hour format. Configuration aborted.")
-                logging.warning(f"Configuration aborted due to invalid operating hours format by {ctx.author.display_name}")
+                logger.warning("Configuration aborted due to invalid operating hours format by %s", ctx.author.display_name)
                 return
 
             # Save configuration
-            configurations[guild_id] = {
+            config_store.set_guild(guild_id, {
                 'description': chode_description,
                 'timezone': user_timezone,
                 'special_instructions': special_instructions,
                 'operating_hours': operating_hours,
                 'personality': chode_description
-            }
-            save_configurations(configurations)
+            })
 
             try:
                 await ctx.send("Configuration complete! Chode is now set up and ready to use.")
-                logging.info(f"Configured guild {guild.name} ({guild_id}) with description: {chode_description}, timezone: {user_timezone}, instructions: {special_instructions}, operating_hours: {operating_hours}")
+                logger.info("Configured guild %s (%s)", guild.name, guild_id)
+                logger.debug("Guild %s configuration: description: %s, timezone: %s, instructions: %s, operating_hours: %s", guild_id, chode_description, user_timezone, special_instructions, operating_hours)
             except Exception as e:
-                logging.error(f"Failed to send configuration completion message: {str(e)}")
+                logger.error("Failed to send configuration completion message: %s", e)
 
         except asyncio.TimeoutError:
             try:
                 await ctx.send("Configuration timed out. Please try again later.")
-                logging.warning(f"Configuration timed out for guild {guild.name}")
+                logger.warning("Configuration timed out for guild %s", guild.name)
             except Exception as e:
-                logging.error(f"Failed to send timeout message: {str(e)}")
+                logger.error("Failed to send timeout message: %s", e)
         except Exception as e:
-            logging.error(f"Error during configuration: {str(e)}")
+            logger.error("Error during configuration: %s", e)
             try:
                 await ctx.send("An error occurred during configuration. Please try again later.")
             except Exception as e2:
-                logging.error(f"Failed to send generic configuration error message: {str(e2)}")
+                logger.error("Failed to send generic configuration error message: %s", e2)
 
     @bot.command(name='genimg')
     async def genimg(ctx, *, prompt: str):
@@ -203,6 +215,13 @@ def setup(bot):
         Generates an image based on the provided prompt using ComfyUI.
         Usage: !!genimg <your prompt here>
         """
+        # Image generation dependencies are only imported when the command is used
+        import io
+        import uuid
+        import aiohttp
+        import websockets
+        from PIL import Image
+
         await ctx.send(f"�️ Generating image for prompt: `{prompt}`. This may take a moment...")
 
         server_address = COMFYUI_SERVER_ADDRESS
@@ -246,13 +265,13 @@ def setup(bot):
                 prompt_id = queue_response.get('prompt_id')
                 if not prompt_id:
                     await ctx.send("❌ Failed to queue the prompt. Please try again later.")
-                    logging.error("No prompt_id returned from ComfyUI.")
+                    logger.error("No prompt_id returned from ComfyUI.")
                     return
 
                 # Connect to WebSocket
                 ws_url = f"ws://{server_address}:{server_port}/ws?clientId={client_id}"
                 async with websockets.connect(ws_url) as websocket:
-                    logging.info(f"Connected to ComfyUI WebSocket at {ws_url}")
+                    logger.info("Connected to ComfyUI WebSocket at %s", ws_url)
 
                     # Listen for messages until execution is done
                     while True:
@@ -263,14 +282,14 @@ def setup(bot):
                                 if msg_json.get('type') == 'executing' and msg_json.get('data', {}).get('prompt_id') == prompt_id:
                                     node = msg_json['data'].get('node')
                                     if node is None:
-                                        logging.info("Image generation completed.")
+                                        logger.info("Image generation completed.")
                                         break  # Execution done
                         except asyncio.TimeoutError:
                             await ctx.send("⏰ Image generation timed out. Please try again.")
-                            logging.warning("WebSocket listening timed out.")
+                            logger.warning("WebSocket listening timed out.")
                             return
                         except websockets.exceptions.ConnectionClosed:
-                            logging.warning("WebSocket connection closed unexpectedly.")
+                            logger.warning("WebSocket connection closed unexpectedly.")
                             break
 
                 # Retrieve history
@@ -292,16 +311,16 @@ def setup(bot):
 
                 if not images:
                     await ctx.send("❌ No images were generated. Please check the prompt and try again.")
-                    logging.warning("No images found in ComfyUI history.")
+                    logger.warning("No images found in ComfyUI history.")
                     return
 
                 # Send images to Discord
                 for idx, img in enumerate(images, start=1):
                     file = discord.File(fp=img, filename=f"generated_image_{idx}.png")
                     await ctx.send(file=file)
-                    logging.info(f"Sent generated_image_{idx}.png to {ctx.guild.name} in channel {ctx.channel.name}")
+                    logger.info("Sent generated_image_%s.png to %s in channel %s", idx, ctx.guild.name, ctx.channel.name)
 
         except Exception as e:
-            logging.error(f"Error in genimg command: {str(e)}")
+            logger.error("Error in genimg command: %s", e)
             await ctx.send(f"❌ An error occurred while generating the image: {str(e)}")
 
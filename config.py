@@ -2,16 +2,42 @@ import os
 import logging
 from dotenv import load_dotenv
 
+from logging_setup import setup_logging, parse_log_levels, level_from_name
+from state_store import create_store, StoreMapping
+
 # ---------------------- Setup and Configuration ----------------------
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    filename='bot.log',
-    format='%(asctime)s:%(levelname)s:%(message)s'
+# Shard processes get their own log, chat log and profile files (see shard_file_name)
+SHARD_IDS = os.getenv('SHARD_IDS')  # e.g. "0,2": run only these shards in this process
+
+def shard_file_name(filename):
+    """Add this process's shard ids to a file name, e.g. bot.log -> bot.shards-0-2.log."""
+    if not SHARD_IDS:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}.shards-{SHARD_IDS.replace(',', '-')}{ext}"
+
+# Logging settings
+LOG_FILE = shard_file_name(os.getenv('LOG_FILE', 'bot.log'))
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', 'discord=WARNING')  # e.g. "chode.events=DEBUG,discord=WARNING"
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 5 * 1024 * 1024))  # Rotate after 5 Megabytes
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+LOG_ROTATE_HOURS = float(os.getenv('LOG_ROTATE_HOURS', 24))  # Rotate at least daily, 0 disables
+LOG_DEBUG_SAMPLE_EVERY = int(os.getenv('LOG_DEBUG_SAMPLE_EVERY', 10))  # Keep 1 in N debug lines per call site
+
+# Configure logging (queue-based, written and rotated on a background thread)
+setup_logging(
+    filename=LOG_FILE,
+    level=level_from_name(LOG_LEVEL, logging.INFO),
+    category_levels=parse_log_levels(LOG_LEVELS),
+    max_bytes=LOG_MAX_BYTES,
+    backup_count=LOG_BACKUP_COUNT,
+    rotate_seconds=int(LOG_ROTATE_HOURS * 3600),
+    debug_sample_every=LOG_DEBUG_SAMPLE_EVERY
 )
 
 # Access environment variables
@@ -29,16 +55,54 @@ if not DISCORD_TOKEN:
 # Constants for file paths and settings
 BANNED_WORDS = ['badword1', 'badword2']  # Replace with actual banned words
 CONFIG_FILE = 'configurations.json'
-HISTORY_FILE = 'chat_history.txt'
+HISTORY_FILE = shard_file_name('chat_history.txt')
 WHATSNEW_FILE = 'whatsnew.txt'
-USER_PROFILES_FILE = 'user_profiles.json'
+USER_PROFILES_FILE = shard_file_name('user_profiles.json')
 MAX_HISTORY_SIZE = 10 * 1024 * 1024  # 10 Megabytes
 
+# Shared state and sharding
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')  # memory, sqlite or redis
+STATE_SQLITE_FILE = os.getenv('STATE_SQLITE_FILE', 'state.db')
+STATE_REDIS_URL = os.getenv('STATE_REDIS_URL', 'redis://127.0.0.1:6379/0')
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 1))  # Total number of gateway shards
+SHARD_PROCESSES = int(os.getenv('SHARD_PROCESSES', SHARD_COUNT))  # Number of shard processes to spawn
+STATE_PRELOADED = os.getenv('STATE_PRELOADED') == '1'  # Set by the shard supervisor for shared stores
+
+# Retrieval memory
+EMBEDDINGS_BACKEND = os.getenv('EMBEDDINGS_BACKEND', 'http')  # http or sentence-transformers
+EMBEDDINGS_URL = os.getenv('EMBEDDINGS_URL', 'http://localhost:1234/v1/embeddings')  # Local LMStudio embeddings endpoint
+EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL', 'text-embedding-nomic-embed-text-v1.5')
+EMBEDDINGS_QUERY_TIMEOUT = float(os.getenv('EMBEDDINGS_QUERY_TIMEOUT', 2))  # Seconds; replies go out without retrieval if exceeded
+MEMORY_RECENT_MESSAGES = int(os.getenv('MEMORY_RECENT_MESSAGES', 20))  # Recent turns sent verbatim
+MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', 4))  # Earlier snippets retrieved per request
+MEMORY_BATCH_SIZE = int(os.getenv('MEMORY_BATCH_SIZE', 32))
+MEMORY_MAX_VECTORS = int(os.getenv('MEMORY_MAX_VECTORS', 50000))  # Per guild
+HISTORY_HOT_MESSAGES = int(os.getenv('HISTORY_HOT_MESSAGES', 64))  # Older messages per channel are kept compressed
+HISTORY_MAX_MESSAGES = int(os.getenv('HISTORY_MAX_MESSAGES', 2000))  # Per channel; older messages are dropped
+
+# Batching of joins and reactions
+BATCH_WINDOW_SECONDS = float(os.getenv('BATCH_WINDOW_SECONDS', 5))  # Collect events per channel for this long
+BACKEND_WORKERS = int(os.getenv('BACKEND_WORKERS', 5))  # Threads for LLM, embedding and snapshot work
+FAST_PATH_QUEUE_DEPTH = int(os.getenv('FAST_PATH_QUEUE_DEPTH', BACKEND_WORKERS))  # Use templates once this many backend jobs are queued or running
+MAX_NAMES_LISTED = 10
+
+# Activity tracking and the 'Active' role
+ACTIVITY_WINDOW_HOURS = float(os.getenv('ACTIVITY_WINDOW_HOURS', 72))  # Sliding window for counting messages
+ACTIVITY_BUCKET_MINUTES = int(os.getenv('ACTIVITY_BUCKET_MINUTES', 60))
+ACTIVE_ROLE_THRESHOLD = int(os.getenv('ACTIVE_ROLE_THRESHOLD', 20))  # Messages in the window to earn the role
+ACTIVE_ROLE_NOTIFY = os.getenv('ACTIVE_ROLE_NOTIFY', 'false').lower() == 'true'  # DM members when they get the role
+ROLE_RECONCILE_MINUTES = float(os.getenv('ROLE_RECONCILE_MINUTES', 10))
+ROLE_UPDATES_PER_RUN = int(os.getenv('ROLE_UPDATES_PER_RUN', 50))  # Per guild; the rest wait for the next run
+ROLE_UPDATE_DELAY = float(os.getenv('ROLE_UPDATE_DELAY', 1.0))  # Seconds between role API calls
+
+# Warm-restart snapshots (used with the in-process memory store)
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', 'state.snapshot')
+SNAPSHOT_INTERVAL_MINUTES = float(os.getenv('SNAPSHOT_INTERVAL_MINUTES', 10))
+
 # Emoji Pools
 STANDARD_EMOJIS = [
     "�", "�", "❤️", "✨", "�", "�", "�", "�", "�", "�"
 ]
-CUSTOM_EMOJIS = {}  # Will be populated per guild
 
 # ---------------------- Helper Functions ----------------------
 
@@ -49,6 +113,17 @@ def get_absolute_path(filename):
     """
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
 
+# ---------------------- State Store ----------------------
+
+# Per-guild state lives behind a pluggable store so shard processes can share it
+STATE_STORE = create_store(
+    STATE_BACKEND,
+    sqlite_path=get_absolute_path(STATE_SQLITE_FILE),
+    redis_url=STATE_REDIS_URL
+)
+
+CUSTOM_EMOJIS = StoreMapping(STATE_STORE, 'custom_emojis', key_type=int)  # Will be populated per guild
+
 # ---------------------- Other Configuration-Related Functions ----------------------
 
 # Add other configuration-related functions here if needed
@@ -0,0 +1,200 @@
+# config_store.py
+
+import os
+import json
+import time
+import atexit
+import asyncio
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger('chode.config_store')
+
+# ---------------------- Configuration Store ----------------------
+
+class ConfigurationStore:
+    """
+    Per-guild configuration backed by a JSON file.
+    Changes are tracked per guild and written out after a short debounce with an atomic
+    write-rename. The file is watched for outside edits, which are loaded without a restart.
+    Listeners registered with subscribe() are told which guild changed so derived caches
+    can be rebuilt for that guild only.
+    """
+
+    def __init__(self, configurations, path, debounce=2.0, watch_interval=5.0):
+        self.configurations = configurations
+        self.path = path
+        self.debounce = debounce
+        self.watch_interval = watch_interval
+        self.dirty = set()
+        self.last_change = 0.0
+        self.file_mtime = None
+        self.file_contents = {}  # This process's last view of the file, to spot outside edits
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.task = None
+        atexit.register(self.flush)
+
+    # ---------------------- Reading ----------------------
+
+    def read_file(self):
+        """Read the configuration file, returning {} if it is missing and None if it cannot be parsed."""
+        if not os.path.exists(self.path):
+            logger.info("%s not found. Starting with empty configurations.", os.path.basename(self.path))
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except json.JSONDecodeError as e:
+            logger.error("Error decoding %s: %s", os.path.basename(self.path), e)
+        except Exception as e:
+            logger.error("Unexpected error loading %s: %s", os.path.basename(self.path), e)
+        return None
+
+    def _stat_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self):
+        """
+        Load the file into the configurations and notify listeners of guilds that changed.
+        A guild counts as changed if it differs from the configurations or from this process's
+        last view of the file; with a shared state store another process may already have
+        copied the edit into the configurations, but this process's caches still need rebuilding.
+        """
+        mtime = self._stat_mtime()
+        loaded = self.read_file()
+        if loaded is None:
+            # Keep the current configuration when the file is mid-edit or broken
+            self.file_mtime = mtime
+            return []
+
+        changed = []
+        with self.lock:
+            previous, self.file_contents = self.file_contents, loaded
+            for guild_id, config in loaded.items():
+                if guild_id in self.dirty:
+                    continue  # Local change not yet written wins over the file
+                if self.configurations.get(guild_id) != config:
+                    self.configurations[guild_id] = config
+                    changed.append(guild_id)
+                elif previous.get(guild_id) != config:
+                    changed.append(guild_id)
+            for guild_id in set(self.configurations) | set(previous):
+                if guild_id in loaded or guild_id in self.dirty:
+                    continue
+                if guild_id in self.configurations:
+                    del self.configurations[guild_id]
+                changed.append(guild_id)
+            self.file_mtime = mtime
+
+        for guild_id in changed:
+            self._notify(guild_id)
+        return changed
+
+    # ---------------------- Writing ----------------------
+
+    def get(self, guild_id, default=None):
+        return self.configurations.get(str(guild_id), default)
+
+    def set_guild(self, guild_id, config):
+        """Replace a guild's configuration; it is written to disk after the debounce delay."""
+        guild_id = str(guild_id)
+        with self.lock:
+            self.configurations[guild_id] = config
+            self.dirty.add(guild_id)
+            self.last_change = time.monotonic()
+        self._notify(guild_id)
+
+    def mark_dirty(self, guild_id=None):
+        """Mark one guild, or every guild, as needing to be written."""
+        with self.lock:
+            if guild_id is None:
+                self.dirty.update(self.configurations)
+            else:
+                self.dirty.add(str(guild_id))
+            self.last_change = time.monotonic()
+
+    def flush(self):
+        """
+        Write dirty guilds to disk now.
+        Guilds that were not changed here are taken from the file as it is on disk,
+        so concurrent edits to other guilds are not overwritten.
+        """
+        with self.write_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                dirty, self.dirty = self.dirty, set()
+                changes = {guild_id: self.configurations.get(guild_id) for guild_id in dirty}
+
+            on_disk = self.read_file() or {}
+            for guild_id, config in changes.items():
+                if config is None:
+                    on_disk.pop(guild_id, None)
+                else:
+                    on_disk[guild_id] = config
+            try:
+                self._atomic_write(on_disk)
+                self.file_mtime = self._stat_mtime()
+                self.file_contents = on_disk
+                logger.info("Configurations saved to %s (%s guild(s) changed).", os.path.basename(self.path), len(dirty))
+            except Exception as e:
+                with self.lock:
+                    self.dirty |= dirty
+                logger.error("Error saving configurations: %s", e)
+
+    def _atomic_write(self, data):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.configurations.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(data, file, separators=(',', ':'))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # ---------------------- Change Notifications ----------------------
+
+    def subscribe(self, callback):
+        """Register callback(guild_id) to be called whenever a guild's configuration changes."""
+        self.listeners.append(callback)
+        return callback
+
+    def _notify(self, guild_id):
+        for callback in self.listeners:
+            try:
+                callback(guild_id)
+            except Exception as e:
+                logger.error("Configuration listener %s failed for guild %s: %s", callback.__name__, guild_id, e)
+
+    # ---------------------- Background Task ----------------------
+
+    def start(self, loop):
+        """Start the background flush/watch task once."""
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        """Flush debounced changes and hot-reload the file when it changes on disk."""
+        last_check = 0.0
+        while True:
+            now = time.monotonic()
+            if self.dirty and now - self.last_change >= self.debounce:
+                await asyncio.to_thread(self.flush)
+            if now - last_check >= self.watch_interval:
+                last_check = now
+                mtime = self._stat_mtime()
+                if mtime != self.file_mtime:
+                    changed = await asyncio.to_thread(self.load)
+                    if changed:
+                        logger.info("Reloaded %s: %s guild(s) changed.", os.path.basename(self.path), len(changed))
+            await asyncio.sleep(min(self.debounce, self.watch_interval, 1.0))
@@ -3,33 +3,103 @@ import discord
 from helpers import (
     log_chat_history, assign_role_based_on_activity, generate_response_async,
     send_long_message, is_message_allowed, is_within_operating_hours,
-    fetch_custom_emojis, last_message_time, configurations, chat_histories
+    fetch_custom_emojis, last_message_time, get_operating_hours,
+    is_backend_busy, welcome_template, reaction_template, format_names,
+    state_ready, hydrate_guild, hydrated_guilds, activity_tracker, run_state_write, memory
 )
+from presence import presence_index
+from batching import EventBatcher
+from config import BATCH_WINDOW_SECONDS
+
+logger = logging.getLogger('chode.events')
 
 def setup(bot):
 
+    async def send_welcome(channel, members):
+        """Welcome everyone who joined during the batch window with one message."""
+        guild = channel.guild
+        await state_ready.wait()
+        await hydrate_guild(guild)
+        names = [member.display_name for member in members]
+        if is_backend_busy():
+            response = welcome_template(guild.id, names)
+        else:
+            prompt = f"Welcome {format_names(names)} to the server! Make them feel at home."
+            response = await generate_response_async(prompt, guild, channel.id)
+        try:
+            if response:
+                await send_long_message(channel, response)
+                logger.info("Sent welcome message to %s new member(s) in guild %s", len(names), guild.name)
+            else:
+                logger.warning("No response generated for welcome message to %s new member(s) in guild %s", len(names), guild.name)
+        except Exception as e:
+            logger.error("Failed to send welcome message: %s", e)
+
+    async def send_reaction_ack(channel, reactions):
+        """Acknowledge every reaction added during the batch window with one message."""
+        guild = channel.guild
+        await state_ready.wait()
+        await hydrate_guild(guild)
+        names = [name for name, emoji in reactions]
+        emojis = [emoji for name, emoji in reactions]
+        if is_backend_busy():
+            response = reaction_template(guild.id if guild else None, names, emojis)
+        else:
+            prompt = f"{format_names(names)} reacted with {' '.join(dict.fromkeys(emojis))} to my messages. Acknowledge their reactions."
+            response = await generate_response_async(prompt, guild, channel.id)
+        try:
+            if response:
+                await send_long_message(channel, response)
+                logger.info("Sent reaction acknowledgment for %s reaction(s) in channel %s", len(reactions), channel.id)
+                logger.debug("Reaction acknowledgment preview: %.50s...", response)
+            else:
+                logger.warning("No response generated for %s reaction(s) in channel %s", len(reactions), channel.id)
+        except Exception as e:
+            logger.error("Failed to send reaction acknowledgment: %s", e)
+
+    welcome_batcher = EventBatcher(send_welcome, window=BATCH_WINDOW_SECONDS)
+    reaction_batcher = EventBatcher(send_reaction_ack, window=BATCH_WINDOW_SECONDS)
+
     @bot.event
     async def on_guild_join(guild):
         """Event triggered when the bot joins a new guild."""
-        fetch_custom_emojis(guild)
-        logging.info(f"Joined new guild: {guild.name} (ID: {guild.id}) and fetched its custom emojis.")
+        await fetch_custom_emojis(guild)
+        logger.info("Joined new guild: %s (ID: %s) and fetched its custom emojis.", guild.name, guild.id)
+
+    @bot.event
+    async def on_guild_available(guild):
+        """Event triggered when a guild becomes available, including after a reconnect."""
+        presence_index.refresh(guild)
+
+    @bot.event
+    async def on_guild_remove(guild):
+        """Event triggered when the bot leaves or is removed from a guild."""
+        presence_index.remove_guild(guild.id)
+        hydrated_guilds.pop(guild.id, None)
+
+    @bot.event
+    async def on_presence_update(before, after):
+        """Event triggered when a member's status or activity changes."""
+        presence_index.update_member(after)
+
+    @bot.event
+    async def on_member_update(before, after):
+        """Event triggered when a member's nickname or roles change."""
+        if before.display_name != after.display_name:
+            presence_index.update_member(after)
+
+    @bot.event
+    async def on_member_remove(member):
+        """Event triggered when a member leaves the guild."""
+        presence_index.remove_member(member)
 
     @bot.event
     async def on_member_join(member):
         """Event triggered when a new member joins the guild."""
-        guild = member.guild
-        welcome_channel = discord.utils.get(guild.text_channels, name="welcome")
+        presence_index.update_member(member)
+        welcome_channel = discord.utils.get(member.guild.text_channels, name="welcome")
         if welcome_channel:
-            prompt = f"Welcome {member.display_name} to the server! Make them feel at home."
-            response = generate_response_async(prompt, guild, welcome_channel.id)
-            try:
-                if response:
-                    await send_long_message(welcome_channel, response)
-                    logging.info(f"Sent welcome message to {member.display_name} in guild {guild.name}")
-                else:
-                    logging.warning(f"No response generated for welcome message to {member.display_name} in guild {guild.name}")
-            except Exception as e:
-                logging.error(f"Failed to send welcome message: {str(e)}")
+            welcome_batcher.add(welcome_channel, member)
 
     @bot.event
     async def on_reaction_add(reaction, user):
@@ -38,22 +108,12 @@ def setup(bot):
             return
 
         message = reaction.message
-        guild = message.guild
 
         # Only respond to reactions on the bot's own messages
         if message.author != bot.user:
             return
 
-        prompt = f"{user.display_name} reacted with {reaction.emoji} to my message. Acknowledge their reaction."
-        response = generate_response_async(prompt, guild, message.channel.id)
-        try:
-            if response:
-                await send_long_message(message.channel, response)
-                logging.info(f"Sent reaction acknowledgment to {user.display_name}: {response[:50]}...")
-            else:
-                logging.warning(f"No response generated for reaction from {user.display_name}")
-        except Exception as e:
-            logging.error(f"Failed to send reaction acknowledgment: {str(e)}")
+        reaction_batcher.add(message.channel, (user.display_name, str(reaction.emoji)))
 
     @bot.event
     async def on_message(message):
@@ -61,9 +121,15 @@ def setup(bot):
         if message.author == bot.user:
             return
 
-        # Log and update activity
-        log_chat_history(message)
-        last_message_time[message.channel.id] = discord.utils.utcnow()
+        # Startup state is loaded in the background while the gateway connects
+        await state_ready.wait()
+        await hydrate_guild(message.guild)
+
+        # Log and update activity; roles are applied later by reconcile_active_roles
+        await run_state_write(log_chat_history, message)
+        await run_state_write(last_message_time.__setitem__, message.channel.id, discord.utils.utcnow())
+        if message.guild and not message.author.bot:
+            activity_tracker.record(message.guild.id, message.author.id)
 
         guild = message.guild
         if guild:
@@ -71,32 +137,36 @@ def setup(bot):
         else:
             guild_id = None
 
-        if guild_id and guild_id in configurations:
-            config = configurations[guild_id]
-            operating_hours = config.get('operating_hours')
-            if operating_hours:
-                try:
-                    start_str, end_str = operating_hours.split('-')
-                    start_time = discord.utils.parse_time(start_str.strip())
-                    end_time = discord.utils.parse_time(end_str.strip())
-                    within_hours = is_within_operating_hours(discord.utils.utcnow().time(), start_time, end_time)
-                except ValueError:
-                    logging.error(f"Invalid operating hours format for guild {guild_id}.")
-                    within_hours = False
-            else:
-                within_hours = True
+        hours = get_operating_hours(guild_id) if guild_id else None
+        if hours is False:
+            within_hours = False
+        elif hours:
+            within_hours = is_within_operating_hours(discord.utils.utcnow().time(), *hours)
         else:
             within_hours = True
 
-        if not is_message_allowed(message.content):
+        if not is_message_allowed(message.content, guild_id):
             try:
                 await message.delete()
                 await send_long_message(channel=message.channel, content=f"Sorry {message.author.mention}, your message contained inappropriate language.")
-                logging.info(f"Deleted inappropriate message from {message.author.display_name}: {message.content}")
+                logger.info("Deleted inappropriate message from %s in channel %s", message.author.display_name, message.channel.id)
+                logger.debug("Deleted message content: %s", message.content)
             except Exception as e:
-                logging.error(f"Failed to delete message or send warning: {str(e)}")
+                logger.error("Failed to delete message or send warning: %s", e)
             return
 
+        # Overriding on_message disables the default command handling, so dispatch '!!' commands
+        # here; commands get only their own reply, not an LLM response as well
+        ctx = await bot.get_context(message)
+        if ctx.valid:
+            if not message.author.bot:
+                await bot.invoke(ctx)
+            return
+
+        # Only messages that passed the banned-word check are embedded for retrieval memory
+        if guild:
+            memory.add(guild.id, message.author.display_name, message.content)
+
         # Handle interactions
         if 'chode' in message.content.lower() or message.content.startswith('!!'):
             prompt = f"{message.author.display_name} has said: {message.content}"
@@ -104,5 +174,5 @@ def setup(bot):
                 response_from_chode = await generate_response_async(prompt, guild, message.channel.id)
                 if response_from_chode:
                     await send_long_message(message.channel, response_from_chode)
-                    logging.info(f"Responded to message from {message.author.display_name}: {response_from_chode[:50]}...")
-
+                    logger.info("Responded to message from %s", message.author.display_name)
+                    logger.debug("Response preview: %.50s...", response_from_chode)
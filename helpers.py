@@ -3,31 +3,73 @@
 import os
 import json
 import logging
-import requests
 import random
 import asyncio
-import aiohttp
-import websockets
+import threading
 import concurrent.futures
 from datetime import datetime, timedelta
+import discord
 from discord.ext import tasks
-from PIL import Image
-import io
-import uuid
 
 from config import (
     CONFIG_FILE, HISTORY_FILE, WHATSNEW_FILE, USER_PROFILES_FILE,
     MAX_HISTORY_SIZE, BANNED_WORDS, STANDARD_EMOJIS, CUSTOM_EMOJIS,
-    COMFYUI_API_URL, COMFYUI_API_TOKEN, COMFYUI_SERVER_ADDRESS, COMFYUI_SERVER_PORT
+    COMFYUI_API_URL, COMFYUI_API_TOKEN, COMFYUI_SERVER_ADDRESS, COMFYUI_SERVER_PORT,
+    STATE_STORE, EMBEDDINGS_BACKEND, EMBEDDINGS_URL, EMBEDDINGS_MODEL, MEMORY_RECENT_MESSAGES,
+    MEMORY_TOP_K, MEMORY_BATCH_SIZE, MEMORY_MAX_VECTORS, FAST_PATH_QUEUE_DEPTH, BACKEND_WORKERS, MAX_NAMES_LISTED,
+    HISTORY_HOT_MESSAGES, HISTORY_MAX_MESSAGES, ACTIVITY_WINDOW_HOURS, ACTIVITY_BUCKET_MINUTES, ACTIVE_ROLE_THRESHOLD,
+    ACTIVE_ROLE_NOTIFY, ROLE_UPDATES_PER_RUN, ROLE_UPDATE_DELAY, EMBEDDINGS_QUERY_TIMEOUT
 )
+from state_store import StoreMapping
+from config_store import ConfigurationStore
+from presence import presence_index
+from memory import RetrievalMemory, create_embedder
+from snapshot import save_snapshot, load_snapshot
+from history import ChannelHistory
+from activity import ActivityTracker
+
+logger = logging.getLogger('chode.helpers')
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """Thread pool that counts the jobs submitted to it that are queued or running."""
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self.pending_lock:
+            self.pending += 1
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except Exception:
+            self._finished(None)
+            raise
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self.pending_lock:
+            self.pending -= 1
 
 # ---------------------- Global Variables ----------------------
 
-last_message_time = {}
+last_message_time = StoreMapping(STATE_STORE, 'last_message_time', key_type=int)
 inactivity_threshold = 260  # in minutes
-chat_histories = {}
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
-configurations = {}
+chat_histories = StoreMapping(STATE_STORE, 'chat_histories', key_type=int)
+executor = CountingExecutor(BACKEND_WORKERS)  # LLM requests, embedding batches and snapshot writes
+state_writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)  # Chat log and state store writes, in order, off the event loop
+configurations = StoreMapping(STATE_STORE, 'configurations')
+activity_tracker = ActivityTracker(ACTIVITY_WINDOW_HOURS, ACTIVITY_BUCKET_MINUTES)
+activity_store = StoreMapping(STATE_STORE, 'activity', key_type=int)  # Counters persisted per guild with shared stores
+state_ready = asyncio.Event()  # Set once startup state has been loaded in the background
+hydrated_guilds = {}  # guild_id -> task filling that guild's per-guild caches, started on first use
+emoji_cache = {}  # guild_id -> custom emojis; this process's copy of CUSTOM_EMOJIS for the guilds it serves
+memory = RetrievalMemory(
+    create_embedder(EMBEDDINGS_BACKEND, EMBEDDINGS_URL, EMBEDDINGS_MODEL),
+    executor, batch_size=MEMORY_BATCH_SIZE, max_size=MEMORY_MAX_VECTORS, query_timeout=EMBEDDINGS_QUERY_TIMEOUT
+)
 
 # ---------------------- Helper Functions ----------------------
 
@@ -35,58 +77,102 @@ def get_absolute_path(filename):
     """Get the absolute path of a file relative to the script."""
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
 
-def load_configurations():
-    """Load configurations from the JSON file."""
-    config_path = get_absolute_path(CONFIG_FILE)
-    if not os.path.exists(config_path):
-        logging.info(f"{CONFIG_FILE} not found. Starting with empty configurations.")
-        return {}
-    try:
-        with open(config_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
-    except json.JSONDecodeError as e:
-        logging.error(f"Error decoding {CONFIG_FILE}: {str(e)}")
-        return {}
-    except Exception as e:
-        logging.error(f"Unexpected error loading {CONFIG_FILE}: {str(e)}")
-        return {}
-
-def save_configurations(configurations):
-    """Save configurations to the JSON file."""
-    config_path = get_absolute_path(CONFIG_FILE)
-    try:
-        with open(config_path, 'w', encoding='utf-8') as file:
-            json.dump(configurations, file, indent=4)
-        logging.info(f"Configurations saved to {CONFIG_FILE}.")
-    except Exception as e:
-        logging.error(f"Error saving configurations: {str(e)}")
-
-def load_chat_history():
-    """Load chat history from the log file."""
+# Atomic, debounced, hot-reloaded persistence for configurations
+config_store = ConfigurationStore(configurations, get_absolute_path(CONFIG_FILE))
+
+# ---------------------- Configuration Caches ----------------------
+
+# Derived from configurations and rebuilt per guild when that guild's configuration changes
+personality_cache = {}
+operating_hours_cache = {}
+banned_words_cache = {}
+
+@config_store.subscribe
+def invalidate_guild_caches(guild_id):
+    """Drop cached values derived from a guild's configuration."""
+    guild_id = str(guild_id)
+    personality_cache.pop(guild_id, None)
+    operating_hours_cache.pop(guild_id, None)
+    banned_words_cache.pop(guild_id, None)
+
+def get_operating_hours(guild_id):
+    """
+    Get a guild's parsed operating hours as (start_time, end_time).
+    Returns None if none are configured and False if the configured value is invalid.
+    """
+    guild_id = str(guild_id)
+    if guild_id in operating_hours_cache:
+        return operating_hours_cache[guild_id]
+    operating_hours = configurations.get(guild_id, {}).get('operating_hours')
+    hours = None
+    if operating_hours:
+        try:
+            start_str, end_str = operating_hours.split('-')
+            hours = (datetime.strptime(start_str.strip(), "%H:%M").time(),
+                     datetime.strptime(end_str.strip(), "%H:%M").time())
+        except ValueError:
+            logger.error("Invalid operating hours format for guild %s. Expected 'HH:MM-HH:MM'.", guild_id)
+            hours = False
+    operating_hours_cache[guild_id] = hours
+    return hours
+
+def get_banned_words(guild_id):
+    """Get the banned words for a guild: the global list plus any from its 'banned_words' setting."""
+    if guild_id is None:
+        return BANNED_WORDS
+    guild_id = str(guild_id)
+    words = banned_words_cache.get(guild_id)
+    if words is None:
+        extra = configurations.get(guild_id, {}).get('banned_words', [])
+        words = tuple(dict.fromkeys(word.lower() for word in [*BANNED_WORDS, *extra] if word))
+        banned_words_cache[guild_id] = words
+    return words
+
+def new_channel_history(entries=()):
+    """Create the compact history container used for each channel."""
+    return ChannelHistory(entries, hot_limit=HISTORY_HOT_MESSAGES)
+
+def append_chat_history(channel_id, role, content):
+    """Append one message to a channel's history, keeping at most HISTORY_MAX_MESSAGES."""
+    chat_histories.append(channel_id, {"role": role, "content": content}, HISTORY_MAX_MESSAGES, factory=new_channel_history)
+
+async def run_state_write(func, *args):
+    """Run a chat log or state store write on the writer thread, after any queued before it."""
+    return await asyncio.get_running_loop().run_in_executor(state_writer, func, *args)
+
+def load_chat_history(offset=0, since=None):
+    """
+    Load chat history from the log file.
+    Parsing starts at byte offset; with since (a 'YYYY-MM-DD HH:MM:SS' string) only newer lines are kept.
+    """
     history_path = get_absolute_path(HISTORY_FILE)
     if not os.path.exists(history_path):
-        logging.info(f"{HISTORY_FILE} not found. Starting with empty chat histories.")
+        logger.info("%s not found. Starting with empty chat histories.", HISTORY_FILE)
         return {}
     chat_histories_loaded = {}
     try:
-        with open(history_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                try:
-                    parts = line.strip().split('] ')[1].split(':', 3)
-                    guild_id, channel_id, username, content = parts
-                    guild_id = int(guild_id)
-                    channel_id = int(channel_id)
-                    if channel_id not in chat_histories_loaded:
-                        chat_histories_loaded[channel_id] = []
-                    chat_histories_loaded[channel_id].append({"role": "user", "content": content})
-                except Exception as e:
-                    logging.error(f"Failed to parse line in chat history: {line}. Error: {str(e)}")
+        with open(history_path, 'rb') as file:
+            file.seek(offset)
+            lines = file.read().decode('utf-8', errors='replace').split('\n')
+        for line in lines:
+            if not line or (since and line[1:20] <= since):
+                continue
+            try:
+                parts = line.strip().split('] ')[1].split(':', 3)
+                guild_id, channel_id, username, content = parts
+                guild_id = int(guild_id)
+                channel_id = int(channel_id)
+                if channel_id not in chat_histories_loaded:
+                    chat_histories_loaded[channel_id] = new_channel_history()
+                chat_histories_loaded[channel_id].append_message("user", content)
+            except Exception as e:
+                logger.error("Failed to parse line in chat history: %s. Error: %s", line, e)
     except Exception as e:
-        logging.error(f"Failed to load chat history: {str(e)}")
+        logger.error("Failed to load chat history: %s", e)
     return chat_histories_loaded
 
 def log_chat_history(message):
-    """Log chat history to a file and update in-memory chat_histories."""
+    """Log chat history to a file and update chat_histories. Runs on the writer thread."""
     try:
         timestamp = message.created_at.strftime("%Y-%m-%d %H:%M:%S")
         history_path = get_absolute_path(HISTORY_FILE)
@@ -100,17 +186,14 @@ def log_chat_history(message):
             # Keep the last half of the lines
             with open(history_path, 'w', encoding='utf-8') as file:
                 file.writelines(lines[len(lines)//2:])
-            logging.info(f"Trimmed chat history to maintain under {MAX_HISTORY_SIZE} bytes.")
+            logger.info("Trimmed chat history to maintain under %s bytes.", MAX_HISTORY_SIZE)
 
-        # Update in-memory chat_histories
-        channel_id = message.channel.id
-        if channel_id not in chat_histories:
-            chat_histories[channel_id] = []
-        chat_histories[channel_id].append({"role": "user", "content": message.content})
+        # Update chat_histories
+        append_chat_history(message.channel.id, "user", message.content)
 
         update_user_profile(message.author)
     except Exception as e:
-        logging.error(f"Failed to log message: {str(e)}")
+        logger.error("Failed to log message: %s", e)
 
 def update_user_profile(user):
     """Update user profile in JSON."""
@@ -127,29 +210,34 @@ def update_user_profile(user):
         with open(profiles_path, 'w', encoding='utf-8') as file:
             json.dump(profiles, file, indent=4)
     except Exception as e:
-        logging.error(f"Failed to update user profile: {str(e)}")
+        logger.error("Failed to update user profile: %s", e)
+
+def get_member_statuses(guild, page=1):
+    """Get one page of currently online members as (text, page, total_pages)."""
+    presence_index.ensure(guild)
+    return presence_index.page(guild.id, page)
 
-def get_member_statuses(guild):
-    """Get a list of currently online members."""
-    statuses = []
-    for member in guild.members:
-        if member.status != discord.Status.offline and not member.bot:
-            status = f"{member.display_name} ({member.status})"
-            statuses.append(status)
-    return '\n'.join(statuses) if statuses else "No members are currently online."
+def get_online_member_count(guild):
+    """Get the number of currently online members."""
+    presence_index.ensure(guild)
+    return presence_index.count(guild.id)
 
 def generate_response(conversation_text, guild, channel_id):
     """Generate a response using LMStudio."""
+    import requests  # Deferred until the first request to keep startup fast
     personality = load_personality(guild.id)
     url = "http://localhost:1234/v1/chat/completions"  # Local LMStudio API endpoint
     headers = {"Content-Type": "application/json"}
 
-    if channel_id not in chat_histories:
-        chat_histories[channel_id] = []
+    append_chat_history(channel_id, "user", conversation_text)
 
-    chat_histories[channel_id].append({"role": "user", "content": conversation_text})
-
-    messages = [{"role": "system", "content": personality}] + chat_histories[channel_id]
+    # Send only the recent turns verbatim; older context comes from retrieval memory
+    recent = chat_histories.tail(channel_id, MEMORY_RECENT_MESSAGES)
+    messages = [{"role": "system", "content": personality}]
+    snippets = memory.retrieve(guild.id, conversation_text, MEMORY_TOP_K, exclude={entry["content"] for entry in recent})
+    if snippets:
+        messages.append({"role": "system", "content": "Relevant earlier conversation:\n" + "\n".join(snippets)})
+    messages += recent
 
     payload = {
         "model": "your-openwebui-model",  # Ensure correct model name
@@ -162,15 +250,15 @@ def generate_response(conversation_text, guild, channel_id):
         response.raise_for_status()
         if response.content.strip():
             bot_response = response.json()["choices"][0]["message"]['content']
-            chat_histories[channel_id].append({"role": "assistant", "content": bot_response})
+            append_chat_history(channel_id, "assistant", bot_response)
             return bot_response
         else:
             return "Error: The response was empty."
     except requests.RequestException as e:
-        logging.error(f"Response generation failed: {str(e)}")
+        logger.error("Response generation failed: %s", e)
         return f"Error: Failed to generate response due to {str(e)}"
     except ValueError as e:
-        logging.error(f"JSON parsing failed: {str(e)}")
+        logger.error("JSON parsing failed: %s", e)
         return f"Error: Failed to parse response as JSON: {str(e)}"
 
 async def generate_response_async(conversation_text, guild, channel_id):
@@ -178,16 +266,61 @@ async def generate_response_async(conversation_text, guild, channel_id):
     loop = asyncio.get_event_loop()
     return await loop.run_in_executor(executor, generate_response, conversation_text, guild, channel_id)
 
+def is_backend_busy():
+    """Whether enough backend jobs are queued or running that low-value events should skip the LLM."""
+    return executor.pending >= FAST_PATH_QUEUE_DEPTH
+
+# ---------------------- Templates ----------------------
+
+WELCOME_TEMPLATES = [
+    "Welcome to the server, {names}! {emoji}",
+    "Hey {names}, glad you're here! {emoji}",
+    "Everyone say hi to {names}! {emoji}"
+]
+
+REACTION_TEMPLATES = [
+    "Thanks for the {reactions}, {names}! {emoji}",
+    "Appreciate the {reactions}, {names} {emoji}"
+]
+
+def pick_emoji(guild_id):
+    """Pick a random emoji from the guild's custom emojis and the standard pool."""
+    return random.choice(emoji_cache.get(guild_id, []) + STANDARD_EMOJIS)
+
+def format_names(names):
+    """Join names as 'A, B and C', listing at most MAX_NAMES_LISTED."""
+    names = list(dict.fromkeys(names))
+    if len(names) > MAX_NAMES_LISTED:
+        hidden = len(names) - MAX_NAMES_LISTED
+        names = names[:MAX_NAMES_LISTED] + [f"{hidden} other{'s' if hidden > 1 else ''}"]
+    if len(names) == 1:
+        return names[0]
+    return f"{', '.join(names[:-1])} and {names[-1]}"
+
+def welcome_template(guild_id, names):
+    """Welcome message for one or more new members without using the LLM."""
+    return random.choice(WELCOME_TEMPLATES).format(names=format_names(names), emoji=pick_emoji(guild_id))
+
+def reaction_template(guild_id, names, reactions):
+    """Reaction acknowledgement for one or more users without using the LLM."""
+    return random.choice(REACTION_TEMPLATES).format(
+        names=format_names(names), reactions=' '.join(dict.fromkeys(reactions)), emoji=pick_emoji(guild_id)
+    )
+
 def load_personality(guild_id):
     """Load personality from configuration or use default."""
     try:
-        config = configurations.get(str(guild_id), {})
-        return config.get('personality', "Your name is Chode. Always answer with short, direct answers. State that you are in Safe Mode.")
+        personality = personality_cache.get(str(guild_id))
+        if personality is None:
+            config = configurations.get(str(guild_id), {})
+            personality = config.get('personality', "Your name is Chode. Always answer with short, direct answers. State that you are in Safe Mode.")
+            personality_cache[str(guild_id)] = personality
+        return personality
     except Exception as e:
-        logging.error(f"Failed to load personality for guild {guild_id}: {str(e)}")
+        logger.error("Failed to load personality for guild %s: %s", guild_id, e)
         return "Your name is Chode. Always answer with short, direct answers. State that you are in Safe Mode."
 
-async def assign_role_based_on_activity(user, guild):
+async def assign_role_based_on_activity(user, guild, notify=True):
     """Assign the 'Active' role based on user activity."""
     if guild is None:
         return
@@ -195,19 +328,110 @@ async def assign_role_based_on_activity(user, guild):
     active_role = discord.utils.get(guild.roles, name="Active")
     if active_role and active_role not in user.roles:
         try:
-            await user.add_roles(active_role)
-            await user.send("You've been assigned the 'Active' role for your engagement!")
-            logging.info(f"Assigned 'Active' role to {user.display_name} in guild {guild.name}")
+            await user.add_roles(active_role, reason="Active in the last activity window")
+            if notify:
+                await user.send("You've been assigned the 'Active' role for your engagement!")
+            logger.info("Assigned 'Active' role to %s in guild %s", user.display_name, guild.name)
+        except Exception as e:
+            logger.error("Failed to assign role: %s", e)
+
+async def remove_role_for_inactivity(user, guild):
+    """Remove the 'Active' role from a member who is no longer active."""
+    active_role = discord.utils.get(guild.roles, name="Active")
+    if active_role and active_role in user.roles:
+        try:
+            await user.remove_roles(active_role, reason="Inactive in the last activity window")
+            logger.info("Removed 'Active' role from %s in guild %s", user.display_name, guild.name)
         except Exception as e:
-            logging.error(f"Failed to assign role: {str(e)}")
+            logger.error("Failed to remove role: %s", e)
+
+def plan_active_role_changes(guild, active_role):
+    """
+    Work out who should gain or lose the 'Active' role from the activity window.
+    Members gain it at ACTIVE_ROLE_THRESHOLD messages and only lose it below half
+    of that, so members near the threshold don't flip back and forth. Nobody loses
+    it until the guild's counters cover a whole window, e.g. right after a restart
+    that could not restore them.
+    """
+    totals = activity_tracker.totals(guild.id)
+    activity_tracker.compact(guild.id, totals)
+    additions = []
+    for user_id, count in totals.items():
+        if count >= ACTIVE_ROLE_THRESHOLD:
+            member = guild.get_member(user_id)
+            if member and not member.bot and active_role not in member.roles:
+                additions.append(member)
+    removals = []
+    if activity_tracker.covers_window(guild.id):
+        removals = [
+            member for member in active_role.members
+            if totals.get(member.id, 0) < ACTIVE_ROLE_THRESHOLD / 2
+        ]
+    return additions, removals
+
+def save_activity():
+    """Write this process's activity counters to a shared state store."""
+    for guild_id in list(activity_tracker.guilds):
+        activity_store[guild_id] = activity_tracker.export_guild(guild_id)
+
+async def reconcile_active_roles(bot, interval_minutes):
+    """
+    Periodically apply 'Active' role changes in paced batches.
+    At most ROLE_UPDATES_PER_RUN changes are made per guild per run, ROLE_UPDATE_DELAY
+    seconds apart; anything left over is picked up on the next run.
+    """
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        for guild in bot.guilds:
+            active_role = discord.utils.get(guild.roles, name="Active")
+            if active_role is None or guild.id not in activity_tracker.guilds:
+                continue
+            additions, removals = plan_active_role_changes(guild, active_role)
+            if STATE_STORE.shared:
+                await run_state_write(activity_store.__setitem__, guild.id, activity_tracker.export_guild(guild.id))
+            changes = [(member, True) for member in additions] + [(member, False) for member in removals]
+            if not changes:
+                continue
+            logger.info("Active role in guild %s: %s to add, %s to remove.", guild.name, len(additions), len(removals))
+            for member, add in changes[:ROLE_UPDATES_PER_RUN]:
+                if add:
+                    await assign_role_based_on_activity(member, guild, notify=ACTIVE_ROLE_NOTIFY)
+                else:
+                    await remove_role_for_inactivity(member, guild)
+                await asyncio.sleep(ROLE_UPDATE_DELAY)
 
-def fetch_custom_emojis(guild):
+async def fetch_custom_emojis(guild):
     """Fetch custom emojis from a guild."""
     try:
-        CUSTOM_EMOJIS[guild.id] = [str(emoji) for emoji in guild.emojis]
-        logging.debug(f"Fetched {len(CUSTOM_EMOJIS[guild.id])} custom emojis from guild '{guild.name}'.")
+        emojis = emoji_cache[guild.id] = [str(emoji) for emoji in guild.emojis]
+        await run_state_write(CUSTOM_EMOJIS.__setitem__, guild.id, emojis)
+        logger.debug("Fetched %s custom emojis from guild '%s'.", len(emojis), guild.name)
     except Exception as e:
-        logging.error(f"Failed to fetch custom emojis for guild '{guild.name}': {str(e)}")
+        logger.error("Failed to fetch custom emojis for guild '%s': %s", guild.name, e)
+
+async def hydrate_guild(guild):
+    """
+    Fill per-guild caches the first time a guild is seen, instead of for every guild at startup.
+    Later callers wait for the same task, so events for the guild see the caches filled.
+    """
+    if guild is None:
+        return
+    task = hydrated_guilds.get(guild.id)
+    if task is None:
+        task = hydrated_guilds[guild.id] = asyncio.ensure_future(_hydrate_guild(guild))
+    await task
+
+async def _hydrate_guild(guild):
+    await fetch_custom_emojis(guild)
+    if STATE_STORE.shared and guild.id not in activity_tracker.guilds:
+        # Pick up counters saved by an earlier run of the process that owns this guild
+        try:
+            state = await asyncio.to_thread(activity_store.get, guild.id)
+        except Exception as e:
+            logger.error("Failed to load activity for guild '%s': %s", guild.name, e)
+            return
+        if guild.id not in activity_tracker.guilds:
+            activity_tracker.import_guild(guild.id, state)
 
 async def proactive_engagement(channel):
     """Send proactive engagement messages to inactive channels."""
@@ -221,25 +445,27 @@ async def proactive_engagement(channel):
     if response and response.startswith("http"):
         try:
             await send_long_message(channel, f"Here is a generated image to spark the conversation: {response}")
-            logging.info(f"Sent proactive image to {channel.name}: {response}")
+            logger.info("Sent proactive image to %s: %s", channel.name, response)
         except Exception as e:
-            logging.error(f"Failed to send proactive image to {channel.name}: {str(e)}")
+            logger.error("Failed to send proactive image to %s: %s", channel.name, e)
     else:
         try:
             await send_long_message(channel, "No one has been active lately. Let's get the conversation going!")
-            logging.info(f"Sent proactive engagement message to {channel.name}")
+            logger.info("Sent proactive engagement message to %s", channel.name)
         except Exception as e:
-            logging.error(f"Failed to send proactive engagement message to {channel.name}: {str(e)}")
+            logger.error("Failed to send proactive engagement message to %s: %s", channel.name, e)
 
-def is_message_allowed(message_content):
+def is_message_allowed(message_content, guild_id=None):
     """Check if the message contains any banned words."""
-    for word in BANNED_WORDS:
-        if word in message_content.lower():
+    content = message_content.lower()
+    for word in get_banned_words(guild_id):
+        if word in content:
             return False
     return True
 
 def generate_image(prompt):
     """Generate an image using ComfyUI."""
+    import requests
     try:
         headers = {
             "Authorization": f"Bearer {COMFYUI_API_TOKEN}",
@@ -262,10 +488,10 @@ def generate_image(prompt):
         else:
             return "Error: The API response did not contain an image URL."
     except requests.RequestException as e:
-        logging.error(f"Image generation failed: {str(e)}")
+        logger.error("Image generation failed: %s", e)
         return f"Error: Failed to generate image due to {str(e)}"
     except ValueError as e:
-        logging.error(f"JSON parsing failed: {str(e)}")
+        logger.error("JSON parsing failed: %s", e)
         return f"Error: Failed to parse response as JSON: {str(e)}"
 
 def is_within_operating_hours(current_time, start_time, end_time):
@@ -274,7 +500,7 @@ def is_within_operating_hours(current_time, start_time, end_time):
         result = start_time <= current_time <= end_time
     else:
         result = current_time >= start_time or current_time <= end_time
-    logging.debug(f"Operating Hours Check - Start: {start_time}, End: {end_time}, Current: {current_time}, Within: {result}")
+    logger.debug("Operating Hours Check - Start: %s, End: %s, Current: %s, Within: %s", start_time, end_time, current_time, result)
     return result
 
 async def send_long_message(channel, content, filename="response.txt", **kwargs):
@@ -282,54 +508,141 @@ async def send_long_message(channel, content, filename="response.txt", **kwargs)
     if len(content) <= 2000:
         try:
             await channel.send(content, **kwargs)
-            logging.debug(f"Sent message to {channel.name}: {content[:50]}...")
+            logger.debug("Sent message to %s: %.50s...", channel.name, content)
         except Exception as e:
-            logging.error(f"Failed to send message to {channel.name}: {str(e)}")
+            logger.error("Failed to send message to %s: %s", channel.name, e)
     else:
         try:
             chunks = [content[i:i+2000] for i in range(0, len(content), 2000)]
             for chunk in chunks:
                 await channel.send(chunk, **kwargs)
                 await asyncio.sleep(1)
-            logging.debug(f"Sent long message to {channel.name} in {len(chunks)} parts.")
+            logger.debug("Sent long message to %s in %s parts.", channel.name, len(chunks))
         except Exception as e:
-            logging.error(f"Failed to send long message to {channel.name}: {str(e)}")
+            logger.error("Failed to send long message to %s: %s", channel.name, e)
             try:
                 with open(filename, 'w', encoding='utf-8') as f:
                     f.write(content)
                 await channel.send(file=discord.File(fp=filename, filename=filename))
-                logging.debug(f"Sent long message as file to {channel.name}.")
+                logger.debug("Sent long message as file to %s.", channel.name)
                 os.remove(filename)
             except Exception as e2:
-                logging.error(f"Failed to send message as file to {channel.name}: {str(e2)}")
+                logger.error("Failed to send message as file to %s: %s", channel.name, e2)
 
-async def check_inactivity(bot, configurations):
+async def check_inactivity(bot):
     """Check for inactive channels and send proactive engagement."""
     while True:
-        now = datetime.utcnow()
+        now = discord.utils.utcnow()  # Timezone-aware, like the times recorded in on_message
+        last_times = dict(await asyncio.to_thread(last_message_time.items))  # One bulk read per pass
         for guild in bot.guilds:
-            guild_id_str = str(guild.id)
-            config = configurations.get(guild_id_str, {})
-            operating_hours = config.get('operating_hours')
-            if operating_hours:
-                try:
-                    start_str, end_str = operating_hours.split('-')
-                    start_time = datetime.strptime(start_str.strip(), "%H:%M").time()
-                    end_time = datetime.strptime(end_str.strip(), "%H:%M").time()
-                    current_time = datetime.now().time()
-                    if not is_within_operating_hours(current_time, start_time, end_time):
-                        continue
-                except ValueError:
-                    logging.error(f"Invalid operating hours format for guild {guild.id}. Expected 'HH:MM-HH:MM'.")
-                    continue
+            hours = get_operating_hours(guild.id)
+            if hours is False:
+                continue
+            if hours and not is_within_operating_hours(datetime.now().time(), *hours):
+                continue
 
             for channel in guild.text_channels:
-                last_time = last_message_time.get(channel.id, now)
+                last_time = last_times.get(channel.id, now)
                 if now - last_time > timedelta(minutes=inactivity_threshold):
                     await proactive_engagement(channel)
-                    last_message_time[channel.id] = now
+                    await run_state_write(last_message_time.__setitem__, channel.id, now)
         await asyncio.sleep(60)
 
+# ---------------------- Snapshots ----------------------
+
+def read_history_head(history_path):
+    """First bytes of the chat log, used to tell whether it was trimmed since a snapshot."""
+    if not os.path.exists(history_path):
+        return b''
+    with open(history_path, 'rb') as file:
+        return file.read(256)
+
+def collect_snapshot(activity):
+    """
+    Copy the in-memory state needed for a warm restart.
+    Run on the state writer thread, so the chat log offset and the copied histories
+    reflect the same log writes. activity is activity_tracker.export_state(), taken on
+    the event loop that updates it. Retrieval memory vectors are not copied here but
+    when the snapshot is pickled.
+    """
+    history_path = get_absolute_path(HISTORY_FILE)
+    histories = {}
+    for channel_id in chat_histories:
+        history = chat_histories.get(channel_id)
+        if history is not None:
+            histories[channel_id] = history.copy()
+    return {
+        'created': datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        'history_offset': os.path.getsize(history_path) if os.path.exists(history_path) else 0,
+        'history_head': read_history_head(history_path),
+        'chat_histories': histories,
+        'last_message_time': dict(last_message_time),
+        'custom_emojis': dict(CUSTOM_EMOJIS),
+        'memory': memory.export_state(),
+        'activity': activity
+    }
+
+def write_snapshot(path):
+    """Collect and write a snapshot now, once queued state writes have finished."""
+    try:
+        state = state_writer.submit(collect_snapshot, activity_tracker.export_state()).result()
+        size = save_snapshot(path, state)
+        logger.info("Saved state snapshot to %s (%s bytes).", path, size)
+    except Exception as e:
+        logger.error("Failed to save state snapshot: %s", e)
+
+def restore_snapshot(path):
+    """
+    Restore state from a snapshot, then replay chat log lines written after it.
+    Returns False if there is no usable snapshot.
+    """
+    state = load_snapshot(path)
+    if state is None:
+        return False
+    for channel_id, history in state['chat_histories'].items():
+        if not isinstance(history, ChannelHistory):
+            history = new_channel_history(history)
+        chat_histories[channel_id] = history
+    last_message_time.update(state['last_message_time'])
+    CUSTOM_EMOJIS.update(state['custom_emojis'])
+    emoji_cache.update(state['custom_emojis'])
+    memory.import_state(state.get('memory'))
+    activity_tracker.import_state(state.get('activity'))
+
+    # Messages logged after the snapshot (e.g. before a crash) are only in the chat log
+    history_path = get_absolute_path(HISTORY_FILE)
+    offset = state.get('history_offset', 0)
+    if (os.path.exists(history_path) and os.path.getsize(history_path) >= offset
+            and read_history_head(history_path) == state.get('history_head')):
+        newer = load_chat_history(offset=offset)
+    else:
+        newer = load_chat_history(since=state['created'])  # Log was trimmed since the snapshot
+    for channel_id, history in newer.items():
+        for entry in history:
+            chat_histories.append(channel_id, entry, HISTORY_MAX_MESSAGES, factory=new_channel_history)
+    logger.info("Restored state snapshot from %s (%s): %s channel(s), %s replayed from the chat log.",
+                path, state['created'], len(state['chat_histories']), len(newer))
+    return True
+
+async def snapshot_loop(path, interval_minutes):
+    """Write a snapshot periodically."""
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        try:
+            state = await run_state_write(collect_snapshot, activity_tracker.export_state())
+            size = await loop.run_in_executor(executor, save_snapshot, path, state)
+            logger.info("Saved state snapshot to %s (%s bytes).", path, size)
+        except Exception as e:
+            logger.error("Failed to save state snapshot: %s", e)
+
+async def flush_memory():
+    """Embed messages waiting in retrieval memory so quiet guilds are indexed too."""
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(30)
+        await loop.run_in_executor(executor, memory.flush)
+
 @tasks.loop(minutes=60)
 async def scheduled_tasks(bot):
     """Scheduled tasks to run every hour."""
@@ -337,13 +650,13 @@ async def scheduled_tasks(bot):
         general_channel = discord.utils.get(guild.text_channels, name="general")
         if general_channel:
             prompt = "Provide a daily summary or reminder for the server."
-            response = generate_response(prompt, guild, general_channel.id)
+            response = await generate_response_async(prompt, guild, general_channel.id)
             try:
                 if response:
                     await send_long_message(general_channel, response)
-                    logging.info(f"Sent scheduled task message to {general_channel.name} in guild {guild.name}")
+                    logger.info("Sent scheduled task message to %s in guild %s", general_channel.name, guild.name)
                 else:
-                    logging.warning(f"No response generated for daily summary in guild {guild.name}")
+                    logger.warning("No response generated for daily summary in guild %s", guild.name)
             except Exception as e:
-                logging.error(f"Failed to send scheduled task message in guild {guild.name}: {str(e)}")
+                logger.error("Failed to send scheduled task message in guild %s: %s", guild.name, e)
 
@@ -0,0 +1,153 @@
+# history.py
+
+import zlib
+import pickle
+import threading
+
+# ---------------------- Channel History ----------------------
+
+ROLES = ('user', 'assistant', 'system')
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+class ChannelHistory:
+    """
+    Compact, list-like chat history for one channel.
+    Messages are kept as a bytearray of role codes plus a list of contents instead of
+    one dict per message. Once more than hot_limit + block_size messages are held, the
+    oldest block_size are compressed into a cold block. Indexing, slicing and iteration
+    render {"role": ..., "content": ...} dicts on demand, so taking the last few turns
+    never touches the cold blocks.
+    Appends come from worker threads while the event loop reads, so every access holds
+    the history's lock; roles and contents are only ever seen updated together.
+    """
+
+    __slots__ = ('roles', 'contents', 'cold', 'cold_count', 'hot_limit', 'block_size', 'lock')
+
+    def __init__(self, entries=(), hot_limit=64, block_size=64):
+        self.roles = bytearray()
+        self.contents = []
+        self.cold = []  # [(count, compressed (roles, contents)), ...], oldest first
+        self.cold_count = 0
+        self.hot_limit = hot_limit
+        self.block_size = block_size
+        self.lock = threading.RLock()
+        for entry in entries:
+            self.append(entry)
+
+    def __getstate__(self):
+        with self.lock:
+            return (bytes(self.roles), list(self.contents), list(self.cold), self.cold_count, self.hot_limit, self.block_size)
+
+    def __setstate__(self, state):
+        roles, self.contents, self.cold, self.cold_count, self.hot_limit, self.block_size = state
+        self.roles = bytearray(roles)
+        self.lock = threading.RLock()
+
+    def append(self, entry):
+        """Append a {"role": ..., "content": ...} message."""
+        self.append_message(entry["role"], entry["content"])
+
+    def append_message(self, role, content):
+        code = ROLE_CODES[role]
+        with self.lock:
+            self.roles.append(code)
+            self.contents.append(content)
+            if self.hot_limit is not None and len(self.contents) > self.hot_limit + self.block_size:
+                self._freeze(self.block_size)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def _freeze(self, count):
+        block = (bytes(self.roles[:count]), self.contents[:count])
+        self.cold.append((count, zlib.compress(pickle.dumps(block, protocol=pickle.HIGHEST_PROTOCOL), 1)))
+        del self.roles[:count]
+        del self.contents[:count]
+        self.cold_count += count
+
+    @staticmethod
+    def _thaw(data):
+        return pickle.loads(zlib.decompress(data))
+
+    def __len__(self):
+        with self.lock:
+            return self.cold_count + len(self.contents)
+
+    def __iter__(self):
+        # Iterate over a consistent copy; cold blocks are immutable and shared
+        with self.lock:
+            cold, roles, contents = list(self.cold), bytes(self.roles), list(self.contents)
+        for count, data in cold:
+            block_roles, block_contents = self._thaw(data)
+            for code, content in zip(block_roles, block_contents):
+                yield {"role": ROLES[code], "content": content}
+        for code, content in zip(roles, contents):
+            yield {"role": ROLES[code], "content": content}
+
+    def __getitem__(self, index):
+        with self.lock:
+            if isinstance(index, slice):
+                indices = range(len(self))[index]
+                if not indices:
+                    return []
+                if indices.step == 1 and indices.start >= self.cold_count:
+                    start, stop = indices.start - self.cold_count, indices.stop - self.cold_count
+                    return [{"role": ROLES[code], "content": content}
+                            for code, content in zip(self.roles[start:stop], self.contents[start:stop])]
+                entries = list(self)
+                return [entries[i] for i in indices]
+            index = range(len(self))[index]
+            if index >= self.cold_count:
+                index -= self.cold_count
+                return {"role": ROLES[self.roles[index]], "content": self.contents[index]}
+            return list(self)[index]
+
+    def __delitem__(self, index):
+        """Only deleting from the front (del history[:n]) is supported, to trim old messages."""
+        if not isinstance(index, slice) or index.start not in (None, 0) or index.step not in (None, 1):
+            raise TypeError("ChannelHistory only supports deleting a leading slice")
+        with self.lock:
+            remaining = len(range(len(self))[index])
+            while remaining and self.cold:
+                count, data = self.cold[0]
+                if count <= remaining:
+                    self.cold.pop(0)
+                    self.cold_count -= count
+                    remaining -= count
+                else:
+                    roles, contents = self._thaw(data)
+                    block = (roles[remaining:], contents[remaining:])
+                    self.cold[0] = (count - remaining, zlib.compress(pickle.dumps(block, protocol=pickle.HIGHEST_PROTOCOL), 1))
+                    self.cold_count -= remaining
+                    remaining = 0
+            del self.roles[:remaining]
+            del self.contents[:remaining]
+
+    def trim(self, max_len):
+        """
+        Drop old messages so that at least the last max_len remain.
+        Only whole cold blocks are dropped, so nothing is recompressed; up to block_size
+        extra messages may be kept.
+        """
+        with self.lock:
+            while self.cold and len(self) - self.cold[0][0] >= max_len:
+                count, data = self.cold.pop(0)
+                self.cold_count -= count
+            if not self.cold and len(self.contents) > max_len:
+                del self.roles[:len(self.contents) - max_len]
+                del self.contents[:len(self.contents) - max_len]
+
+    def copy(self):
+        """Shallow copy; cold blocks are immutable and shared."""
+        other = ChannelHistory(hot_limit=self.hot_limit, block_size=self.block_size)
+        with self.lock:
+            other.roles = bytearray(self.roles)
+            other.contents = list(self.contents)
+            other.cold = list(self.cold)
+            other.cold_count = self.cold_count
+        return other
+
+    def __repr__(self):
+        with self.lock:
+            return f"<ChannelHistory messages={len(self)} cold_blocks={len(self.cold)}>"
@@ -0,0 +1,141 @@
+# logging_setup.py
+
+import os
+import time
+import atexit
+import queue
+import logging
+import logging.handlers
+
+# ---------------------- Handlers and Filters ----------------------
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotating file handler that rolls over when the file grows past max_bytes
+    or when rotate_seconds have passed since the last rollover, whichever comes first.
+    """
+
+    def __init__(self, filename, max_bytes, backup_count, rotate_seconds, encoding='utf-8'):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.rotate_seconds = rotate_seconds
+        # Count from when the existing file was started, so frequent restarts still rotate by age
+        self.rollover_at = self.file_started() + rotate_seconds if rotate_seconds > 0 else None
+
+    def file_started(self):
+        """
+        When the current log file was started: the time of its first record, else its
+        modification time, else now if there is no file yet.
+        """
+        try:
+            with open(self.baseFilename, 'r', encoding='utf-8', errors='replace') as file:
+                first = file.readline()
+            return time.mktime(time.strptime(first[:19], '%Y-%m-%d %H:%M:%S'))
+        except (OSError, ValueError):
+            pass
+        try:
+            return os.stat(self.baseFilename).st_mtime
+        except OSError:
+            return time.time()
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.rollover_at is not None:
+            self.rollover_at = time.time() + self.rotate_seconds
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Let through only one in every `every` DEBUG records per call site.
+    Records at INFO and above are never dropped.
+    """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, int(every))
+        self.counters = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        key = (record.name, record.lineno)
+        count = self.counters.get(key, 0)
+        self.counters[key] = count + 1
+        return count % self.every == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that hands the raw record to the listener thread.
+    The stock QueueHandler formats the message before enqueueing, which would put
+    the string formatting back on the event loop; the queue is in-process, so the
+    record can be passed along untouched and formatted by the file handler.
+    """
+
+    def prepare(self, record):
+        return record
+
+# ---------------------- Setup ----------------------
+
+_listener = None
+
+def level_from_name(name, default=None):
+    """Resolve a level name such as 'DEBUG' to its number, or default if it is not a known level."""
+    level = logging.getLevelName(name.strip().upper())
+    return level if isinstance(level, int) else default
+
+def parse_log_levels(spec):
+    """Parse a 'logger=LEVEL,other=LEVEL' string into a dict of logger names to levels."""
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        name, level = name.strip(), level_from_name(level)
+        if name and level is not None:
+            levels[name] = level
+    return levels
+
+def setup_logging(filename, level=logging.INFO, category_levels=None, max_bytes=5 * 1024 * 1024,
+                  backup_count=5, rotate_seconds=24 * 3600, debug_sample_every=1,
+                  fmt='%(asctime)s:%(levelname)s:%(name)s:%(message)s'):
+    """
+    Route all logging through a queue to a background writer thread.
+    Handlers on the event loop only enqueue records; formatting and file I/O
+    (including rotation) happen on the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = SizeAndTimeRotatingFileHandler(filename, max_bytes, backup_count, rotate_seconds)
+    file_handler.setFormatter(logging.Formatter(fmt))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter(debug_sample_every))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    for name, category_level in (category_levels or {}).items():
+        logging.getLogger(name).setLevel(category_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    """Flush pending records and stop the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,16 +1,31 @@
+import time
+BOOT_TIME = time.perf_counter()  # Taken before the heavier imports below so they are included in the startup breakdown
+
 import discord
 from discord.ext import commands
+import signal
 import logging
 import asyncio
 
-from config import DISCORD_TOKEN  # Uses DISCORD_BOT_TOKEN2 from config.py
+from config import (
+    DISCORD_TOKEN, STATE_STORE, STATE_PRELOADED, SHARD_COUNT, SHARD_PROCESSES, SHARD_IDS,  # Uses DISCORD_BOT_TOKEN2 from config.py
+    SNAPSHOT_INTERVAL_MINUTES, ROLE_RECONCILE_MINUTES
+)
 from helpers import (
-    configurations, load_configurations, load_chat_history, chat_histories,
-    fetch_custom_emojis, check_inactivity, scheduled_tasks
+    config_store, check_inactivity, scheduled_tasks, flush_memory,
+    write_snapshot, snapshot_loop, state_ready, reconcile_active_roles, save_activity
 )
+import startup
+from startup import SNAPSHOTS_ENABLED, SNAPSHOT_PATH, hydrate_state
+from presence import presence_index
 import events
 import commands as bot_commands  # Alias to avoid conflict with 'commands' module
 
+logger = logging.getLogger('chode.main')
+
+# Seconds spent in each startup phase, logged once the bot is ready
+startup_times = {'imports': time.perf_counter() - BOOT_TIME}
+
 # ---------------------- Initialize Bot ----------------------
 
 # Define Discord intents
@@ -21,38 +36,89 @@ intents.presences = True
 intents.members = True
 intents.guilds = True
 
-# Initialize the Bot with '!!' as the command prefix
-bot = commands.Bot(command_prefix='!!', intents=intents)
+def create_bot(shard_ids=None, shard_count=1, load=True):
+    """
+    Create the bot with '!!' as the command prefix.
+    With more than one shard, only the given shard_ids are run in this process.
+    With load, startup state is loaded once the bot starts connecting.
+    """
+    if shard_count > 1:
+        bot = commands.AutoShardedBot(command_prefix='!!', intents=intents, shard_ids=shard_ids, shard_count=shard_count)
+    else:
+        bot = commands.Bot(command_prefix='!!', intents=intents)
 
-# Load configurations and chat history at startup
-configurations.update(load_configurations())
-chat_histories.update(load_chat_history())
-logging.info("Chat history loaded successfully.")
+    # Setup events and commands
+    events.setup(bot)
+    bot_commands.setup(bot)
 
-# Setup events and commands
-events.setup(bot)
-bot_commands.setup(bot)
+    # ---------------------- Bot Events ----------------------
 
-# ---------------------- Bot Events ----------------------
+    async def setup_hook():
+        """Load startup state in the background so the gateway connection starts right away."""
+        bot.loop.create_task(hydrate_state(load, startup_times))
+        # bot.run only handles Ctrl+C; close cleanly on SIGTERM too so the shutdown snapshot and flushes run
+        try:
+            bot.loop.add_signal_handler(signal.SIGTERM, lambda: bot.loop.create_task(bot.close()))
+        except NotImplementedError:
+            pass  # Not supported by the Windows event loop
 
-@bot.event
-async def on_ready():
-    """Event triggered when the bot is ready."""
-    print(f'Logged in as {bot.user}!')
-    bot.loop.create_task(check_inactivity(bot, configurations))
-    scheduled_tasks.start(bot)
-    logging.info(f'Bot connected as {bot.user}')
+    bot.setup_hook = setup_hook
+    background_started = False
 
-    # Fetch custom emojis from all guilds the bot is part of
-    for guild in bot.guilds:
-        fetch_custom_emojis(guild)
-        logging.info(f"Fetched custom emojis for guild: {guild.name} (ID: {guild.id})")
+    @bot.event
+    async def on_ready():
+        """Event triggered when the bot is ready."""
+        nonlocal background_started
+        print(f'Logged in as {bot.user}!')
+        if background_started:
+            logger.info('Bot reconnected as %s', bot.user)
+            # Presence updates may have been missed while disconnected
+            for guild in bot.guilds:
+                presence_index.refresh(guild)
+            return
+        background_started = True
+        startup_times['gateway'] = time.perf_counter() - BOOT_TIME
+        logger.info('Bot connected as %s (shards: %s)', bot.user, shard_ids if shard_count > 1 else 'single')
 
-# ---------------------- Run the Bot ----------------------
+        await state_ready.wait()
+        bot.loop.create_task(check_inactivity(bot))
+        config_store.start(bot.loop)
+        bot.loop.create_task(flush_memory())
+        bot.loop.create_task(reconcile_active_roles(bot, ROLE_RECONCILE_MINUTES))
+        if SNAPSHOTS_ENABLED:
+            bot.loop.create_task(snapshot_loop(SNAPSHOT_PATH, SNAPSHOT_INTERVAL_MINUTES))
+        scheduled_tasks.start(bot)
 
-if __name__ == "__main__":
+        # Per-guild caches (e.g. custom emojis) are filled on each guild's first event
+        logger.info("Startup: imports %.2fs, state load %.2fs (background), gateway ready after %.2fs, %s guild(s).",
+                    startup_times['imports'], startup_times.get('state', 0.0), startup_times['gateway'], len(bot.guilds))
+
+    return bot
+
+def run_bot(shard_ids=None, shard_count=1, load=True):
+    """Run one bot process, optionally restricted to a subset of shards."""
+    bot = create_bot(shard_ids, shard_count, load)
     try:
-        bot.run(DISCORD_TOKEN)  # Uses DISCORD_BOT_TOKEN2 from the environment
+        bot.run(DISCORD_TOKEN, log_handler=None)  # Uses DISCORD_BOT_TOKEN2; discord.py logs go through our queue
     except Exception as e:
-        logging.critical(f"Failed to run the bot: {str(e)}")
+        logger.critical("Failed to run the bot: %s", e)
+    finally:
+        # Never overwrite a good snapshot with state that was not loaded
+        if SNAPSHOTS_ENABLED and startup.state_loaded:
+            write_snapshot(SNAPSHOT_PATH)
+        if STATE_STORE.shared:
+            save_activity()
+        config_store.flush()
+        STATE_STORE.close()
 
+# ---------------------- Run the Bot ----------------------
+
+if __name__ == "__main__":
+    if SHARD_IDS:
+        # Single shard process started by hand or by the supervisor
+        run_bot([int(shard_id) for shard_id in SHARD_IDS.split(',')], SHARD_COUNT, load=not STATE_PRELOADED)
+    elif SHARD_COUNT > 1 and SHARD_PROCESSES > 1:
+        from sharding import run_supervisor
+        run_supervisor(SHARD_COUNT, SHARD_PROCESSES)
+    else:
+        run_bot(list(range(SHARD_COUNT)) if SHARD_COUNT > 1 else None, SHARD_COUNT)
@@ -0,0 +1,215 @@
+# memory.py
+
+import logging
+import threading
+import importlib.util
+
+np = None  # NumPy is imported on first use; retrieval memory is disabled without it
+
+logger = logging.getLogger('chode.memory')
+
+# ---------------------- Embedders ----------------------
+
+class HttpEmbedder:
+    """Embed texts with an OpenAI-compatible /v1/embeddings endpoint (e.g. LMStudio)."""
+
+    def __init__(self, url, model, timeout=30):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+
+    def __call__(self, texts, timeout=None):
+        import requests
+        response = requests.post(self.url, json={"model": self.model, "input": texts}, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+
+class SentenceTransformerEmbedder:
+    """Embed texts with a local sentence-transformers model, loaded on first use."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.model = None
+
+    def __call__(self, texts, timeout=None):
+        # Runs locally, so timeout does not apply
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(self.model_name)
+        return self.model.encode(texts)
+
+
+def create_embedder(backend, url, model):
+    """Create the embedder selected by EMBEDDINGS_BACKEND."""
+    if backend == 'sentence-transformers':
+        return SentenceTransformerEmbedder(model)
+    return HttpEmbedder(url, model)
+
+# ---------------------- Vector Index ----------------------
+
+def load_numpy():
+    """Import NumPy on first use."""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+class VectorIndex:
+    """
+    Unit-normalised float32 vectors with their entries, stored in one growable array.
+    Cosine similarity is a single matrix-vector product over the filled rows.
+    Filled rows are never overwritten in place (dropping old rows copies into a new
+    array), so a view of vectors[:size] stays valid while the index keeps growing.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.vectors = None
+        self.size = 0
+        self.entries = []
+
+    def add(self, vectors, entries):
+        load_numpy()
+        vectors = np.asarray(vectors, dtype=np.float32)[-self.max_size:]
+        entries = list(entries)[-self.max_size:]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        if self.vectors is None:
+            self.vectors = np.empty((max(len(vectors), min(256, self.max_size)), vectors.shape[1]), dtype=np.float32)
+        elif self.vectors.shape[1] != vectors.shape[1]:
+            logger.warning("Embedding size changed from %s to %s; resetting index.", self.vectors.shape[1], vectors.shape[1])
+            self.vectors = np.empty((max(len(vectors), min(256, self.max_size)), vectors.shape[1]), dtype=np.float32)
+            self.size = 0
+            self.entries = []
+
+        needed = self.size + len(vectors)
+        if needed > self.max_size:
+            # Drop the oldest entries to stay within max_size
+            keep = max(0, self.max_size - len(vectors))
+            trimmed = np.empty((self.max_size, self.vectors.shape[1]), dtype=np.float32)
+            trimmed[:keep] = self.vectors[self.size - keep:self.size]
+            self.vectors = trimmed
+            self.entries = self.entries[self.size - keep:] if keep else []
+            self.size = keep
+            needed = self.size + len(vectors)
+        if needed > len(self.vectors):
+            grown = np.empty((min(max(needed, len(self.vectors) * 2), self.max_size), self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+
+        self.vectors[self.size:needed] = vectors
+        self.entries.extend(entries)
+        self.size = needed
+
+    def search(self, query, k):
+        """Return up to k (score, entry) pairs most similar to the query vector."""
+        if self.size == 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.vectors[:self.size] @ query
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.entries[i]) for i in top]
+
+# ---------------------- Retrieval Memory ----------------------
+
+class RetrievalMemory:
+    """
+    Per-guild embedding memory over chat history.
+    Messages are queued as (author, content) and embedded in batches on a worker thread;
+    retrieve() embeds the query and returns the most similar earlier snippets; the query is
+    embedded with query_timeout so a slow embeddings server does not hold up replies.
+    """
+
+    def __init__(self, embedder, executor, batch_size=32, max_size=50000, min_score=0.3, query_timeout=2.0):
+        self.embedder = embedder
+        self.query_timeout = query_timeout
+        self.executor = executor
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.min_score = min_score
+        self.indexes = {}  # guild_id -> VectorIndex
+        self.pending = {}  # guild_id -> [(author, content), ...]
+        self.lock = threading.Lock()
+        self.enabled = importlib.util.find_spec('numpy') is not None
+        if not self.enabled:
+            logger.warning("NumPy is not installed; retrieval memory is disabled.")
+
+    def add(self, guild_id, author, content):
+        """Queue a message for embedding. Full batches are embedded on the executor."""
+        if not self.enabled or not content.strip():
+            return
+        with self.lock:
+            pending = self.pending.setdefault(guild_id, [])
+            pending.append((author, content))
+            ready = len(pending) >= self.batch_size
+        if ready:
+            self.executor.submit(self.flush, guild_id)
+
+    def flush(self, guild_id=None):
+        """Embed queued messages for one guild, or all guilds."""
+        with self.lock:
+            if guild_id is None:
+                batches, self.pending = self.pending, {}
+            else:
+                batches = {guild_id: self.pending.pop(guild_id, [])}
+        for batch_guild_id, entries in batches.items():
+            for start in range(0, len(entries), self.batch_size):
+                chunk = entries[start:start + self.batch_size]
+                try:
+                    vectors = self.embedder([f"{author}: {content}" for author, content in chunk])
+                except Exception as e:
+                    logger.error("Embedding %s messages for guild %s failed: %s", len(chunk), batch_guild_id, e)
+                    continue
+                with self.lock:
+                    index = self.indexes.get(batch_guild_id)
+                    if index is None:
+                        index = self.indexes[batch_guild_id] = VectorIndex(self.max_size)
+                    index.add(vectors, chunk)
+
+    def retrieve(self, guild_id, query, k=4, exclude=()):
+        """Return up to k earlier "author: content" snippets relevant to the query, skipping contents in exclude."""
+        index = self.indexes.get(guild_id) if self.enabled else None
+        if index is None or index.size == 0:
+            return []
+        try:
+            query_vector = self.embedder([query], timeout=self.query_timeout)[0]
+        except Exception as e:
+            logger.error("Embedding query for guild %s failed: %s", guild_id, e)
+            return []
+        with self.lock:
+            results = index.search(query_vector, k + len(exclude))
+        snippets = [f"{author}: {content}" for score, (author, content) in results
+                    if score >= self.min_score and content not in exclude]
+        return snippets[:k]
+
+    def export_state(self):
+        """
+        Take the indexes and queued messages for a snapshot.
+        Vectors are returned as views, not copies, so this is cheap to call on the event
+        loop; they are copied when the snapshot is pickled on a worker thread.
+        """
+        with self.lock:
+            indexes = {
+                guild_id: (index.vectors[:index.size], index.entries[:index.size])
+                for guild_id, index in self.indexes.items() if index.size
+            }
+            pending = {guild_id: list(entries) for guild_id, entries in self.pending.items()}
+        return {'indexes': indexes, 'pending': pending}
+
+    def import_state(self, state):
+        """Restore indexes and queued messages exported by export_state()."""
+        if not self.enabled or not state:
+            return
+        with self.lock:
+            for guild_id, (vectors, entries) in state.get('indexes', {}).items():
+                index = self.indexes[guild_id] = VectorIndex(self.max_size)
+                index.add(vectors, entries)
+            for guild_id, entries in state.get('pending', {}).items():
+                self.pending.setdefault(guild_id, []).extend(entries)
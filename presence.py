@@ -0,0 +1,100 @@
+# presence.py
+
+import math
+import logging
+import discord
+
+logger = logging.getLogger('chode.presence')
+
+# ---------------------- Presence Index ----------------------
+
+class PresenceIndex:
+    """
+    Online, non-bot members per guild, kept up to date from member and presence events.
+    A guild is indexed on first use; after that counts are O(1) and the sorted,
+    paginated view is rendered once and reused until a member of that guild changes.
+    Guilds indexed before their members were chunked are indexed again once they are.
+    """
+
+    def __init__(self, per_page=25):
+        self.per_page = per_page
+        self.online = {}  # guild_id -> {member_id: "name (status)"}
+        self.views = {}   # guild_id -> {'lines': [...], 'pages': {page: text}}
+        self.partial = set()  # guild_ids indexed from an incomplete member cache
+
+    def is_indexed(self, guild_id):
+        return guild_id in self.online
+
+    def rebuild(self, guild):
+        """Index a guild from its member cache."""
+        self.online[guild.id] = {
+            member.id: self._entry(member)
+            for member in guild.members
+            if not member.bot and member.status != discord.Status.offline
+        }
+        self.views.pop(guild.id, None)
+        if guild.chunked:
+            self.partial.discard(guild.id)
+        else:
+            self.partial.add(guild.id)
+        logger.debug("Indexed %s online members in guild %s", len(self.online[guild.id]), guild.id)
+
+    def ensure(self, guild):
+        """Index a guild if it has not been indexed yet, or was indexed before chunking finished."""
+        if guild.id not in self.online or (guild.id in self.partial and guild.chunked):
+            self.rebuild(guild)
+
+    def refresh(self, guild):
+        """Index an already indexed guild again, e.g. after reconnecting, when presence events may have been missed."""
+        if guild.id in self.online:
+            self.rebuild(guild)
+
+    def update_member(self, member):
+        """Apply a member or presence change. Guilds that are not indexed yet are ignored."""
+        online = self.online.get(member.guild.id)
+        if online is None:
+            return
+        if member.bot or member.status == discord.Status.offline:
+            changed = online.pop(member.id, None) is not None
+        else:
+            entry = self._entry(member)
+            changed = online.get(member.id) != entry
+            online[member.id] = entry
+        if changed:
+            self.views.pop(member.guild.id, None)
+
+    def remove_member(self, member):
+        online = self.online.get(member.guild.id)
+        if online is not None and online.pop(member.id, None) is not None:
+            self.views.pop(member.guild.id, None)
+
+    def remove_guild(self, guild_id):
+        self.online.pop(guild_id, None)
+        self.views.pop(guild_id, None)
+        self.partial.discard(guild_id)
+
+    def count(self, guild_id):
+        """Number of online members in an indexed guild."""
+        return len(self.online.get(guild_id, ()))
+
+    def page(self, guild_id, page=1):
+        """Get (text, page, total_pages) for one page of the online member list."""
+        view = self.views.get(guild_id)
+        if view is None:
+            lines = sorted(self.online.get(guild_id, {}).values(), key=str.casefold)
+            view = self.views[guild_id] = {'lines': lines, 'pages': {}}
+        total_pages = max(1, math.ceil(len(view['lines']) / self.per_page))
+        page = min(max(1, page), total_pages)
+        text = view['pages'].get(page)
+        if text is None:
+            start = (page - 1) * self.per_page
+            text = '\n'.join(view['lines'][start:start + self.per_page]) or "No members are currently online."
+            view['pages'][page] = text
+        return text, page, total_pages
+
+    @staticmethod
+    def _entry(member):
+        return f"{member.display_name} ({member.status})"
+
+
+presence_index = PresenceIndex()
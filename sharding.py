@@ -0,0 +1,90 @@
+# sharding.py
+
+import os
+import sys
+import time
+import signal
+import logging
+import subprocess
+
+from config import STATE_STORE, get_absolute_path
+
+logger = logging.getLogger('chode.sharding')
+
+# ---------------------- Shard Supervisor ----------------------
+
+RESTART_DELAY = 5  # seconds before restarting a crashed shard process
+MAX_RESTART_DELAY = 300
+
+def split_shards(shard_count, processes):
+    """Split shard ids 0..shard_count-1 round-robin across the given number of processes."""
+    processes = max(1, min(processes, shard_count))
+    return [list(range(index, shard_count, processes)) for index in range(processes)]
+
+def start_shard_process(shard_ids, shard_count):
+    """Start one bot process that runs only the given shards."""
+    env = dict(os.environ)
+    env['SHARD_IDS'] = ','.join(str(shard_id) for shard_id in shard_ids)
+    env['SHARD_COUNT'] = str(shard_count)
+    if STATE_STORE.shared:
+        env['STATE_PRELOADED'] = '1'
+    process = subprocess.Popen([sys.executable, get_absolute_path('main.py')], env=env)
+    logger.info("Started shard process %s for shards %s", process.pid, shard_ids)
+    return process
+
+def run_supervisor(shard_count, processes):
+    """
+    Run the bot as several shard processes and restart any that exit.
+    Each process owns the guilds of its shards; state is shared through the state store.
+    """
+    if not STATE_STORE.shared:
+        logger.warning("STATE_BACKEND is 'memory': shard processes will not share conversation state.")
+    else:
+        # Load state once here instead of in every shard process
+        from startup import load_state
+        load_state()
+
+    groups = split_shards(shard_count, processes)
+    workers = {index: start_shard_process(shard_ids, shard_count) for index, shard_ids in enumerate(groups)}
+    started = {index: time.monotonic() for index in workers}
+    delays = {index: RESTART_DELAY for index in workers}
+    restart_at = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while not stopping:
+        now = time.monotonic()
+        for index, process in workers.items():
+            if index in restart_at:
+                if now >= restart_at[index]:
+                    del restart_at[index]
+                    workers[index] = start_shard_process(groups[index], shard_count)
+                    started[index] = now
+                continue
+            code = process.poll()
+            if code is None:
+                continue
+            # Back off on crash loops, but start over once a shard has run for a while
+            if now - started[index] > MAX_RESTART_DELAY:
+                delays[index] = RESTART_DELAY
+            logger.error("Shard process %s for shards %s exited with code %s. Restarting in %s seconds.",
+                         process.pid, groups[index], code, delays[index])
+            restart_at[index] = now + delays[index]
+            delays[index] = min(delays[index] * 2, MAX_RESTART_DELAY)
+        time.sleep(1)
+
+    logger.info("Stopping shard processes.")
+    for process in workers.values():
+        process.terminate()
+    for process in workers.values():
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    STATE_STORE.close()
@@ -0,0 +1,47 @@
+# snapshot.py
+
+import os
+import zlib
+import pickle
+import logging
+import tempfile
+
+logger = logging.getLogger('chode.snapshot')
+
+# ---------------------- Snapshot Files ----------------------
+
+# File layout: MAGIC, one version byte, then a zlib-compressed pickle of the state dict
+MAGIC = b'CHODESNP'
+VERSION = 1
+
+def save_snapshot(path, state):
+    """Write state to path atomically. Returns the number of bytes written."""
+    payload = MAGIC + bytes([VERSION]) + zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 3)
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.snapshot.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(payload)
+
+def load_snapshot(path):
+    """Read a snapshot with a single read. Returns None if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as file:
+            payload = file.read()
+        if payload[:len(MAGIC)] != MAGIC or payload[len(MAGIC)] != VERSION:
+            logger.warning("Ignoring snapshot %s: unknown format.", path)
+            return None
+        return pickle.loads(zlib.decompress(payload[len(MAGIC) + 1:]))
+    except Exception as e:
+        logger.error("Failed to load snapshot %s: %s", path, e)
+        return None
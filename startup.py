@@ -0,0 +1,45 @@
+# startup.py
+
+import time
+import asyncio
+import logging
+
+from config import STATE_STORE, SNAPSHOT_FILE, get_absolute_path, shard_file_name
+from helpers import config_store, load_chat_history, chat_histories, restore_snapshot, state_ready
+
+logger = logging.getLogger('chode.startup')
+
+# ---------------------- Startup State ----------------------
+
+# Shared stores persist state themselves; the in-process store is saved to snapshots instead
+SNAPSHOTS_ENABLED = not STATE_STORE.shared
+SNAPSHOT_PATH = get_absolute_path(shard_file_name(SNAPSHOT_FILE))
+
+state_loaded = False  # Whether startup state loaded; a snapshot is only written over it if so
+
+def load_state():
+    """Load configurations and chat history into the state store."""
+    config_store.load()
+    if SNAPSHOTS_ENABLED and restore_snapshot(SNAPSHOT_PATH):
+        return
+    if STATE_STORE.shared and len(chat_histories):
+        logger.info("Using chat history already in the state store.")
+        return
+    chat_histories.update(load_chat_history())
+    logger.info("Chat history loaded successfully.")
+
+async def hydrate_state(load, startup_times):
+    """Load configurations and chat history off the event loop, then release waiting handlers."""
+    global state_loaded
+    start = time.perf_counter()
+    if load:
+        try:
+            await asyncio.to_thread(load_state)
+        except Exception as e:
+            logger.error("Failed to load startup state: %s", e)
+        else:
+            state_loaded = True
+    else:
+        state_loaded = True
+    startup_times['state'] = time.perf_counter() - start
+    state_ready.set()
@@ -0,0 +1,378 @@
+# state_store.py
+
+import pickle
+import sqlite3
+import logging
+import threading
+from collections.abc import MutableMapping
+
+logger = logging.getLogger('chode.state')
+
+# ---------------------- Store Backends ----------------------
+
+class StateStore:
+    """
+    Interface for the bot's shared state.
+    State is grouped in namespaces (e.g. 'chat_histories'), each holding key -> value pairs.
+    Values returned by get() must be treated as read-only; write changes back with set() or append().
+    """
+
+    shared = False  # True when several processes can see the same state
+
+    def get(self, namespace, key, default=None):
+        raise NotImplementedError
+
+    def set(self, namespace, key, value):
+        raise NotImplementedError
+
+    def delete(self, namespace, key):
+        raise NotImplementedError
+
+    def keys(self, namespace):
+        raise NotImplementedError
+
+    def append(self, namespace, key, item, max_len=None, factory=list):
+        """
+        Append an item to the list stored at key, keeping at most max_len items.
+        factory creates the list-like container when the key is new. Containers with a
+        trim(max_len) method trim themselves and may keep a few more items than max_len.
+        """
+        raise NotImplementedError
+
+    def tail(self, namespace, key, count):
+        """Return the last count items of the list stored at key, oldest first."""
+        items = self.get(namespace, key)
+        return list(items[-count:]) if items and count > 0 else []
+
+    def items(self, namespace):
+        """Return every (key, value) pair in a namespace."""
+        return [(key, self.get(namespace, key)) for key in self.keys(namespace)]
+
+    def close(self):
+        pass
+
+
+class MemoryStore(StateStore):
+    """In-process store backed by plain dicts. Only visible to the current process."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, namespace, key, default=None):
+        return self.data.get(namespace, {}).get(str(key), default)
+
+    def set(self, namespace, key, value):
+        with self.lock:
+            self.data.setdefault(namespace, {})[str(key)] = value
+
+    def delete(self, namespace, key):
+        with self.lock:
+            self.data.get(namespace, {}).pop(str(key), None)
+
+    def keys(self, namespace):
+        return list(self.data.get(namespace, {}).keys())
+
+    def items(self, namespace):
+        with self.lock:
+            return list(self.data.get(namespace, {}).items())
+
+    def append(self, namespace, key, item, max_len=None, factory=list):
+        with self.lock:
+            namespace_data = self.data.setdefault(namespace, {})
+            items = namespace_data.get(str(key))
+            if items is None:
+                items = namespace_data[str(key)] = factory()
+            items.append(item)
+            if max_len is not None and hasattr(items, 'trim'):
+                items.trim(max_len)
+            elif max_len is not None and len(items) > max_len:
+                del items[:len(items) - max_len]
+
+
+class SQLiteStore(StateStore):
+    """
+    Store backed by a SQLite database in WAL mode.
+    Several shard processes can open the same file; each process keeps one connection per thread.
+    Lists used with append() are kept one row per item in the items table, so appending
+    and reading the tail never load the whole list.
+    """
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, seq INTEGER NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (namespace, key, seq))"
+        )
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, namespace, key, default=None):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, str(key))
+        ).fetchone()
+        if row:
+            return pickle.loads(row[0])
+        rows = conn.execute(
+            "SELECT value FROM items WHERE namespace = ? AND key = ? ORDER BY seq", (namespace, str(key))
+        ).fetchall()
+        return [pickle.loads(row[0]) for row in rows] if rows else default
+
+    def set(self, namespace, key, value):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM items WHERE namespace = ? AND key = ?", (namespace, str(key)))
+            conn.execute(
+                "INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+                (namespace, str(key), pickle.dumps(value))
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, namespace, key):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM items WHERE namespace = ? AND key = ?", (namespace, str(key)))
+            conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, str(key)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def keys(self, namespace):
+        rows = self._connection().execute(
+            "SELECT key FROM state WHERE namespace = ? UNION SELECT DISTINCT key FROM items WHERE namespace = ?",
+            (namespace, namespace)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def items(self, namespace):
+        rows = self._connection().execute(
+            "SELECT key, value FROM state WHERE namespace = ?", (namespace,)
+        ).fetchall()
+        items = [(key, pickle.loads(value)) for key, value in rows]
+        list_rows = self._connection().execute(
+            "SELECT key, value FROM items WHERE namespace = ? ORDER BY key, seq", (namespace,)
+        ).fetchall()
+        lists = {}
+        for key, value in list_rows:
+            lists.setdefault(key, []).append(pickle.loads(value))
+        return items + list(lists.items())
+
+    def append(self, namespace, key, item, max_len=None, factory=list):
+        # Items are kept as rows, so factory is not used
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, str(key))
+            ).fetchone()
+            if row:
+                # Move a value written with set() over to the row representation
+                conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, str(key)))
+                conn.executemany(
+                    "INSERT INTO items (namespace, key, seq, value) VALUES (?, ?, ?, ?)",
+                    [(namespace, str(key), seq, pickle.dumps(entry)) for seq, entry in enumerate(pickle.loads(row[0]))]
+                )
+            conn.execute(
+                "INSERT INTO items (namespace, key, seq, value) VALUES (?, ?, "
+                "(SELECT COALESCE(MAX(seq), -1) + 1 FROM items WHERE namespace = ? AND key = ?), ?)",
+                (namespace, str(key), namespace, str(key), pickle.dumps(item))
+            )
+            if max_len is not None:
+                conn.execute(
+                    "DELETE FROM items WHERE namespace = ? AND key = ? AND seq <= "
+                    "(SELECT MAX(seq) FROM items WHERE namespace = ? AND key = ?) - ?",
+                    (namespace, str(key), namespace, str(key), max_len)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def tail(self, namespace, key, count):
+        if count <= 0:
+            return []
+        rows = self._connection().execute(
+            "SELECT value FROM items WHERE namespace = ? AND key = ? ORDER BY seq DESC LIMIT ?",
+            (namespace, str(key), count)
+        ).fetchall()
+        if not rows:
+            return super().tail(namespace, key, count)
+        return [pickle.loads(row[0]) for row in reversed(rows)]
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+class RedisStore(StateStore):
+    """
+    Store backed by a Redis-compatible server (Redis, Valkey, KeyDB, ...).
+    Each namespace is a hash; list values used with append() live in their own list keys.
+    """
+
+    shared = True
+
+    def __init__(self, url, prefix='chode:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_BACKEND=redis requires the 'redis' package (pip install redis).")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _hash(self, namespace):
+        return f"{self.prefix}{namespace}"
+
+    def _list(self, namespace, key):
+        return f"{self.prefix}{namespace}:list:{key}"
+
+    def get(self, namespace, key, default=None):
+        raw = self.client.hget(self._hash(namespace), str(key))
+        if raw is not None:
+            return pickle.loads(raw)
+        items = self.client.lrange(self._list(namespace, key), 0, -1)
+        return [pickle.loads(item) for item in items] if items else default
+
+    def set(self, namespace, key, value):
+        pipe = self.client.pipeline()
+        pipe.delete(self._list(namespace, key))
+        pipe.hset(self._hash(namespace), str(key), pickle.dumps(value))
+        pipe.execute()
+
+    def delete(self, namespace, key):
+        pipe = self.client.pipeline()
+        pipe.delete(self._list(namespace, key))
+        pipe.hdel(self._hash(namespace), str(key))
+        pipe.execute()
+
+    def keys(self, namespace):
+        keys = {key.decode() for key in self.client.hkeys(self._hash(namespace))}
+        list_prefix = self._list(namespace, '')
+        for list_key in self.client.scan_iter(match=f"{list_prefix}*"):
+            keys.add(list_key.decode()[len(list_prefix):])
+        return list(keys)
+
+    def items(self, namespace):
+        items = [(key.decode(), pickle.loads(value)) for key, value in self.client.hgetall(self._hash(namespace)).items()]
+        list_prefix = self._list(namespace, '')
+        for list_key in self.client.scan_iter(match=f"{list_prefix}*"):
+            items.append((list_key.decode()[len(list_prefix):], [pickle.loads(item) for item in self.client.lrange(list_key, 0, -1)]))
+        return items
+
+    def append(self, namespace, key, item, max_len=None, factory=list):
+        # Items are kept in a native Redis list, so factory is not used
+        list_key = self._list(namespace, key)
+        existing = self.client.hget(self._hash(namespace), str(key))
+        items = [item] if existing is None else list(pickle.loads(existing)) + [item]
+        pipe = self.client.pipeline()
+        if existing is not None:
+            # Move a value written with set() over to the list representation
+            pipe.hdel(self._hash(namespace), str(key))
+        pipe.rpush(list_key, *[pickle.dumps(entry) for entry in items])
+        if max_len is not None:
+            pipe.ltrim(list_key, -max_len, -1)
+        pipe.execute()
+
+    def tail(self, namespace, key, count):
+        if count <= 0:
+            return []
+        items = self.client.lrange(self._list(namespace, key), -count, -1)
+        if not items:
+            return super().tail(namespace, key, count)
+        return [pickle.loads(item) for item in items]
+
+    def close(self):
+        self.client.close()
+
+
+def create_store(backend, sqlite_path=None, redis_url=None):
+    """Create the state store selected by STATE_BACKEND."""
+    backend = (backend or 'memory').lower()
+    if backend == 'sqlite':
+        logger.info("Using SQLite state store at %s", sqlite_path)
+        return SQLiteStore(sqlite_path)
+    if backend == 'redis':
+        logger.info("Using Redis state store at %s", redis_url)
+        return RedisStore(redis_url)
+    if backend != 'memory':
+        logger.warning("Unknown STATE_BACKEND '%s'. Falling back to in-process memory store.", backend)
+    return MemoryStore()
+
+# ---------------------- Mapping View ----------------------
+
+class StoreMapping(MutableMapping):
+    """
+    Dict-like view over one namespace of a StateStore.
+    Keys are stored as strings and converted back with key_type when iterating.
+    """
+
+    def __init__(self, store, namespace, key_type=str):
+        self.store = store
+        self.namespace = namespace
+        self.key_type = key_type
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.set(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.store.delete(self.namespace, key)
+
+    def __contains__(self, key):
+        return self.store.get(self.namespace, key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        return (self.key_type(key) for key in self.store.keys(self.namespace))
+
+    def __len__(self):
+        return len(self.store.keys(self.namespace))
+
+    def get(self, key, default=None):
+        return self.store.get(self.namespace, key, default)
+
+    def append(self, key, item, max_len=None, factory=list):
+        """Append an item to the list stored at key."""
+        self.store.append(self.namespace, key, item, max_len, factory)
+
+    def tail(self, key, count):
+        """Return the last count items of the list stored at key."""
+        return self.store.tail(self.namespace, key, count)
+
+    def items(self):
+        """Return every (key, value) pair, read from the store in bulk."""
+        return [(self.key_type(key), value) for key, value in self.store.items(self.namespace)]
+
+_MISSING = object()